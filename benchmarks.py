@@ -0,0 +1,278 @@
+"""
+Benchmarks for the SDM analysis functions.
+
+Times the core functions and the subset-transfer sweep on the shipped models, and the
+scaling of each function on synthetic diagrams from ``models.synthetic_id``. Results are
+written as JSON so runs of different versions can be compared.
+
+Run headless with ``python benchmarks.py --output results.json``.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pyAgrum as gum
+
+import models
+from sdm_fun import (
+    NumpyDiagram,
+    build_cid,
+    build_pid,
+    calculate_utility_values,
+    chance_node_transfer,
+    preference_transfer,
+    show_decision_utilities,
+    transfer_lattice,
+    transfer_subset,
+    transfer_sweep,
+    utility_arrays_from_weights,
+    voe,
+)
+
+CU_PARAMETERS = {
+    "remission": 1/7,
+    "hypoparathyroidism": 1/7,
+    "laryngeal": 1/7,
+    "hepatoxicity": 1/7,
+    "agranulocytosis": 1/7,
+    "hypothyroidism": 1/7,
+    "eye_post": 1/7,
+}
+
+PU_PARAMETERS = {
+    "remission": 1,
+    "hypothyroidism": 0,
+    "cost": 1,
+    "lifelong_thyroid_replacement": 2,
+}
+
+EXCLUDED_VARIABLES = {"treatment", "DoctorU", "goiter", "Pre_TSH_Level", "Post_TSH_Level"}
+
+
+def informed_patient_variables(cid):
+    """Clinician variables transferred in the informed patient analysis."""
+    return sorted(cid.names().difference(EXCLUDED_VARIABLES))
+
+
+def time_call(function, repeat=5, setup=None):
+    """
+    Wall time of ``function``, called ``repeat`` times.
+
+    ``setup`` builds fresh arguments outside the timed region for functions that modify
+    their inputs.
+    """
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return {"repeat": repeat, "min": min(times), "mean": sum(times) / len(times)}
+
+
+def bench_functions(repeat=20):
+    """Core sdm_fun functions on the shipped clinician and patient models."""
+    cid = build_cid(CU_PARAMETERS)
+    pid = build_pid(PU_PARAMETERS)
+    cu_arrays = utility_arrays_from_weights(CU_PARAMETERS)
+    compiled = NumpyDiagram(cid)
+
+    def transferred_patient():
+        target = gum.InfluenceDiagram(pid)
+        chance_node_transfer("eye_post", cid, target)
+        return "eye_post", cid, target, CU_PARAMETERS, PU_PARAMETERS.copy()
+
+    return {
+        "calculate_utility_values": time_call(lambda: calculate_utility_values(cid, "DoctorU", cu_arrays), repeat),
+        "chance_node_transfer": time_call(
+            lambda target: chance_node_transfer("eye_post", cid, target), repeat,
+            setup=lambda: (gum.InfluenceDiagram(pid),)),
+        "preference_transfer": time_call(preference_transfer, repeat, setup=transferred_patient),
+        "show_decision_utilities": time_call(lambda: show_decision_utilities(cid), repeat),
+        "show_decision_utilities_numpy": time_call(lambda: show_decision_utilities(compiled), repeat),
+        "show_decision_utilities_sampling": time_call(
+            lambda: show_decision_utilities(compiled, backend="sampling"), repeat),
+        "voe": time_call(lambda: voe(cid), max(1, repeat // 10)),
+    }
+
+
+def bench_sweep(max_k=12, modes=("subsets", "lattice")):
+    """Informed-patient subset-transfer sweep per number of transferred variables."""
+    cid = build_cid(CU_PARAMETERS)
+    variables = informed_patient_variables(cid)
+    results = dict()
+    for mode in modes:
+        per_k = dict()
+        for k in range(1, min(max_k, len(variables)) + 1):
+            start = time.perf_counter()
+            sweep = transfer_sweep(variables, [k], CU_PARAMETERS, PU_PARAMETERS, max_workers=1, mode=mode)
+            per_k[k] = {"subsets": len(sweep[k]), "seconds": time.perf_counter() - start}
+        start = time.perf_counter()
+        transfer_sweep(variables, range(1, min(max_k, len(variables)) + 1), CU_PARAMETERS, PU_PARAMETERS, mode=mode)
+        results[mode] = {"per_k": per_k, "full_sweep_parallel_seconds": time.perf_counter() - start}
+    return results
+
+
+def bench_lattice(max_size=12):
+    """Clone and transfer work of rebuilding every subset versus walking the subset lattice."""
+    cid = build_cid(CU_PARAMETERS)
+    pid = build_pid(PU_PARAMETERS)
+    variables = informed_patient_variables(cid)[:max_size]
+    sizes = range(1, len(variables) + 1)
+
+    subset_stats = dict()
+    start = time.perf_counter()
+    for k in sizes:
+        for subset in itertools.combinations(variables, k):
+            transfer_subset(subset, cid, pid, CU_PARAMETERS, PU_PARAMETERS, stats=subset_stats)
+    subset_time = time.perf_counter() - start
+
+    lattice_stats = dict()
+    start = time.perf_counter()
+    transfer_lattice(variables, sizes, cid, pid, CU_PARAMETERS, PU_PARAMETERS, stats=lattice_stats)
+    lattice_time = time.perf_counter() - start
+
+    return {
+        "variables": len(variables),
+        "subsets": {**subset_stats, "seconds": subset_time},
+        "lattice": {**lattice_stats, "seconds": lattice_time},
+    }
+
+
+def bench_startup(copies=100):
+    """Model construction with the builders versus template copies and the on-disk cache."""
+    start = time.perf_counter()
+    for _ in range(copies):
+        models.clinician_id()
+        models.patient_id()
+    builder_time = time.perf_counter() - start
+
+    models.clear_templates()
+    start = time.perf_counter()
+    for _ in range(copies):
+        models.model_copy("clinician")
+        models.model_copy("patient")
+    template_time = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        models.clear_templates()
+        models.model_template("clinician", cache_dir)
+        models.model_template("patient", cache_dir)
+        # A fresh worker process starts with no templates and finds the cached files
+        models.clear_templates()
+        start = time.perf_counter()
+        models.model_template("clinician", cache_dir)
+        models.model_template("patient", cache_dir)
+        cold_cached_time = time.perf_counter() - start
+    models.clear_templates()
+
+    start = time.perf_counter()
+    models.model_template("clinician")
+    models.model_template("patient")
+    cold_build_time = time.perf_counter() - start
+    models.clear_templates()
+
+    return {
+        "copies": copies,
+        "builders": builder_time,
+        "templates": template_time,
+        "cold_build": cold_build_time,
+        "cold_cached": cold_cached_time,
+    }
+
+
+def bench_scaling(outcomes=(2, 4, 6, 8, 10), states=(2, 3), treatments=(3,), repeat=5):
+    """Scaling of the core functions on synthetic diagrams of increasing size."""
+    results = []
+    for n_states, n_treatments, n_outcomes in itertools.product(states, treatments, outcomes):
+        model = models.synthetic_id(n_outcomes, n_states, n_treatments)
+        host = models.synthetic_id(n_outcomes, n_states, n_treatments, seed=1)
+        weights = {f"outcome_{j}": 1.0 for j in range(n_outcomes)}
+        arrays = utility_arrays_from_weights(weights)
+        calculate_utility_values(model, "U", arrays)
+        calculate_utility_values(host, "U", arrays)
+        transferred = f"outcome_{n_outcomes - 1}"
+
+        def transferred_target():
+            target = gum.InfluenceDiagram(model)
+            chance_node_transfer(transferred, host, target)
+            return transferred, host, target, weights, weights.copy()
+
+        results.append({
+            "outcomes": n_outcomes,
+            "states": n_states,
+            "treatments": n_treatments,
+            "utility_cells": int(n_states ** n_outcomes),
+            "calculate_utility_values": time_call(lambda: calculate_utility_values(model, "U", arrays), repeat),
+            "chance_node_transfer": time_call(
+                lambda target: chance_node_transfer(transferred, host, target), repeat,
+                setup=lambda: (gum.InfluenceDiagram(model),)),
+            "preference_transfer": time_call(preference_transfer, repeat, setup=transferred_target),
+            "show_decision_utilities": time_call(lambda: show_decision_utilities(model), repeat),
+            "show_decision_utilities_numpy": time_call(lambda: show_decision_utilities(model, backend="numpy"), repeat),
+            "show_decision_utilities_sampling": time_call(
+                lambda: show_decision_utilities(model, backend="sampling"), repeat),
+            "voe": time_call(lambda: voe(model), 1),
+        })
+    return results
+
+
+def environment():
+    return {
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "pyAgrum": gum.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+BENCHMARKS = {
+    "functions": bench_functions,
+    "sweep": bench_sweep,
+    "lattice": bench_lattice,
+    "startup": bench_startup,
+    "scaling": bench_scaling,
+}
+
+
+def run(names, max_k=12, quick=False):
+    """Run the named benchmarks and return the JSON-serialisable results."""
+    results = {"environment": environment(), "results": dict()}
+    for name in names:
+        if name == "sweep":
+            results["results"][name] = bench_sweep(min(max_k, 4) if quick else max_k)
+        elif name == "lattice":
+            results["results"][name] = bench_lattice(min(max_k, 6) if quick else max_k)
+        elif name == "scaling" and quick:
+            results["results"][name] = bench_scaling(outcomes=(2, 4, 6), states=(2,), repeat=2)
+        else:
+            results["results"][name] = BENCHMARKS[name]()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("benchmarks", nargs="*", help=f"benchmarks to run ({', '.join(BENCHMARKS)}), all by default")
+    parser.add_argument("--max-k", type=int, default=12, help="largest number of transferred clinician variables")
+    parser.add_argument("--quick", action="store_true", help="smaller sweeps and scaling grid")
+    parser.add_argument("--output", help="JSON file to write, stdout by default")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks).difference(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    results = run(args.benchmarks or list(BENCHMARKS), args.max_k, args.quick)
+    if args.output:
+        with open(args.output, "w") as handle:
+            json.dump(results, handle, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
@@ -0,0 +1,150 @@
+"""
+Load test of the SDM decision service.
+
+Opens ``--connections`` keep-alive connections to a running ``sdm_service.py`` (or starts
+a local one with ``--start``), sends ``--requests`` recommendation requests with random
+evidence and preference weights, and reports the p50/p99 latency and the throughput.
+
+Run with ``python load_test.py --start --requests 2000 --connections 32``.
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks import CU_PARAMETERS, PU_PARAMETERS
+from sdm_fun import NumpyDiagram, build_cid, build_pid
+
+WEIGHTS = {"patient": PU_PARAMETERS, "clinician": CU_PARAMETERS}
+BUILDERS = {"patient": build_pid, "clinician": build_cid}
+
+
+def request_bodies(n_requests, model="patient", n_weights=8, max_evidence=3, voe=5, seed=None):
+    """Random request bodies over ``n_weights`` distinct weight vectors."""
+    rng = random.Random(seed)
+    diagram = BUILDERS[model](WEIGHTS[model])
+    compiled = NumpyDiagram(diagram)
+    labels = compiled.labels
+    observable = list(compiled.cpts)
+    weights = [{name: rng.choice([1, 2, 3]) for name in WEIGHTS[model]} for _ in range(n_weights)]
+    bodies = []
+    for _ in range(n_requests):
+        names = rng.sample(observable, rng.randint(0, max_evidence))
+        evidence = {name: rng.choice(labels[name]) for name in names}
+        bodies.append(json.dumps({"model": model, "weights": rng.choice(weights), "evidence": evidence, "voe": voe}))
+    return bodies
+
+
+async def open_connection(host, port, unix):
+    if unix:
+        return await asyncio.open_unix_connection(unix)
+    return await asyncio.open_connection(host, port)
+
+
+async def post(reader, writer, body):
+    """Status and body of one ``POST /recommend`` on a keep-alive connection."""
+    payload = body.encode()
+    writer.write(f"POST /recommend HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def run_load(bodies, connections=16, host="127.0.0.1", port=8080, unix=None):
+    """Latencies in seconds, error count and wall time of sending ``bodies``."""
+    queue = asyncio.Queue()
+    for body in bodies:
+        queue.put_nowait(body)
+    latencies = []
+    errors = 0
+
+    async def client():
+        nonlocal errors
+        reader, writer = await open_connection(host, port, unix)
+        try:
+            while not queue.empty():
+                body = queue.get_nowait()
+                start = time.perf_counter()
+                status, _ = await post(reader, writer, body)
+                latencies.append(time.perf_counter() - start)
+                errors += status != 200
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(connections)))
+    return np.array(latencies), errors, time.perf_counter() - start
+
+
+async def wait_ready(host, port, unix, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            reader, writer = await open_connection(host, port, unix)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def report(latencies, errors, seconds):
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": seconds,
+        "throughput": len(latencies) / seconds,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(latencies, 99) * 1000),
+        "max_ms": float(latencies.max() * 1000),
+    }
+
+
+async def main(args):
+    bodies = request_bodies(args.requests, args.model, voe=args.voe, seed=args.seed)
+    server = None
+    if args.start:
+        command = [sys.executable, "sdm_service.py", "--workers", str(args.workers)]
+        command += ["--unix", args.unix] if args.unix else ["--host", args.host, "--port", str(args.port)]
+        server = subprocess.Popen(command)
+    try:
+        await wait_ready(args.host, args.port, args.unix)
+        # Warm the model cache so the first requests do not pay for compilation
+        await run_load(bodies[:args.connections], args.connections, args.host, args.port, args.unix)
+        results = report(*await run_load(bodies, args.connections, args.host, args.port, args.unix))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    json.dump(results, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", help="Unix socket path of the service")
+    parser.add_argument("--start", action="store_true", help="start a local service for the test")
+    parser.add_argument("--workers", type=int, default=1, help="executor threads of a started service")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--connections", type=int, default=16)
+    parser.add_argument("--model", choices=sorted(WEIGHTS), default="patient")
+    parser.add_argument("--voe", type=int, default=5, help="top VOE items requested")
+    parser.add_argument("--seed", type=int)
+    asyncio.run(main(parser.parse_args()))
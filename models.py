@@ -1,3 +1,7 @@
+import hashlib
+import marshal
+import os
+import numpy as np
 import pyAgrum as gum
 
 def clinician_id():
@@ -21,12 +25,6 @@ def clinician_id():
     Post_TSH_Level = gbn.add(gum.LabelizedVariable("Post_TSH_Level", "General TSH_Level Status", 3)) # High, Medium, Low
     # Arcs
 
-    gbn.cpt("Pre_TSH_Level")[{'goiter': 'Small','hyperthyroidism':'no'}] = [0.10, 0.50, 0.40]
-    gbn.cpt("Pre_TSH_Level")[{'goiter': 'Large','hyperthyroidism':'no'}] = [0.20, 0.45, 0.35]
-    gbn.cpt("Pre_TSH_Level")[{'goiter': 'Small','hyperthyroidism':'yes'}] = [0.18, 0.42, 0.40]
-    gbn.cpt("Pre_TSH_Level")[{'goiter': 'Large','hyperthyroidism':'yes'}] = [0.41, 0.39, 0.20]
-
-
     gbn.addArc(eye, eye_post)
     #gbn.addArc(goiter,treatment)
     gbn.addArc(hyperthyroidism, goiter)
@@ -262,4 +260,107 @@ def patient_id():
     patient_model.cpt(cost)[{'treatment': 0}] = [0.20, 0.8]   
     patient_model.cpt(cost)[{'treatment': 1}] = [0.50, 0.5]  
     patient_model.cpt(cost)[{'treatment': 2}] = [0.33, 0.67]   
-    return patient_model
\ No newline at end of file
+    return patient_model
+
+
+
+def synthetic_id(n_outcomes, n_states=2, n_treatments=3, n_risk_factors=None, seed=0):
+    """
+    Synthetic clinician-style influence diagram for scaling benchmarks.
+
+    Pre-treatment risk factors ``risk_<i>`` are parents of outcome nodes ``outcome_<j>``,
+    which all depend on the ``treatment`` decision and are the parents of the utility node
+    ``U``. CPTs are drawn from a flat Dirichlet; the utility is left at zero for
+    ``calculate_utility_values`` to fill.
+
+    Parameters
+    ----------
+    n_outcomes : int
+        Number of outcome (utility parent) nodes
+    n_states : int
+        Number of states of every outcome node
+    n_treatments : int
+        Number of treatment options
+    n_risk_factors : int, optional
+        Number of binary risk factors, a third of the outcomes by default
+    seed : int
+        Seed of the CPT sample
+    """
+    rng = np.random.default_rng(seed)
+    if n_risk_factors is None:
+        n_risk_factors = max(1, n_outcomes // 3)
+
+    gbn = gum.InfluenceDiagram()
+    treatment = gbn.addDecisionNode(gum.LabelizedVariable(
+        "treatment", "Treatment", [f"treatment_{d}" for d in range(n_treatments)]))
+    utility = gbn.addUtilityNode(gum.LabelizedVariable("U", "Utility", 1))
+    risks = [gbn.add(gum.LabelizedVariable(f"risk_{i}", f"Risk factor {i}", ["no", "yes"]))
+             for i in range(n_risk_factors)]
+    for j in range(n_outcomes):
+        outcome = gbn.add(gum.LabelizedVariable(f"outcome_{j}", f"Outcome {j}", n_states))
+        gbn.addArc(treatment, outcome)
+        gbn.addArc(risks[j % n_risk_factors], outcome)
+        gbn.addArc(outcome, utility)
+
+    # names() is a set, fill the CPTs in a fixed order so the sample only depends on the seed
+    for name in sorted(gbn.names()):
+        if gbn.isChanceNode(name):
+            cpt = gbn.cpt(name)
+            shape = cpt.toarray().shape
+            cpt[:] = rng.dirichlet(np.ones(shape[-1]), size=shape[:-1])
+    return gbn
+
+
+# Model templates: each base model is built once per process and handed out as copies
+
+MODEL_BUILDERS = {
+    "clinician": clinician_id,
+    "patient": patient_id,
+}
+
+_TEMPLATES = {}
+
+
+def source_hash(builder):
+    """Hash of a model builder's code and the pyAgrum version, used as on-disk cache key."""
+    # The marshalled code object covers the CPT constants and is much cheaper than inspect.getsource
+    source = marshal.dumps(builder.__code__) + gum.__version__.encode()
+    return hashlib.sha1(source).hexdigest()[:16]
+
+
+def model_template(name, cache_dir=None):
+    """
+    Shared template of a base model, built on first use in the process.
+
+    With a ``cache_dir`` (or the ``SDM_MODEL_CACHE`` environment variable) the built
+    diagram is stored as BIFXML keyed by ``source_hash`` and later processes load it
+    instead of rebuilding. The template must not be modified; use ``model_copy``.
+    """
+    if name not in _TEMPLATES:
+        builder = MODEL_BUILDERS[name]
+        cache_dir = cache_dir or os.environ.get("SDM_MODEL_CACHE")
+        path = None
+        if cache_dir:
+            path = os.path.join(cache_dir, f"{name}-{source_hash(builder)}.bifxml")
+        if path and os.path.exists(path):
+            model = gum.loadID(path)
+        else:
+            model = builder()
+            if path:
+                os.makedirs(cache_dir, exist_ok=True)
+                # Write under a temporary name so concurrent workers never read a partial file
+                partial = f"{path}.{os.getpid()}.tmp"
+                model.saveBIFXML(partial)
+                os.replace(partial, path)
+        _TEMPLATES[name] = model
+    return _TEMPLATES[name]
+
+
+def model_copy(name, cache_dir=None):
+    """Independent copy of a base model template."""
+    return gum.InfluenceDiagram(model_template(name, cache_dir))
+
+
+def clear_templates():
+    """Forget the templates built in this process."""
+    _TEMPLATES.clear()
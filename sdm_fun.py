@@ -1,68 +1,305 @@
 
+import contextlib
+import copy
+import functools
+import hashlib
 import itertools 
+import json
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
+import pyAgrum as gum
 from pyAgrum import ShaferShenoyLIMIDInference
+import models
 
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pa = None
+
+
+# Opt-in instrumentation of the hot paths. While profiling is disabled an instrumented
+# function or phase costs one global lookup.
+_PROFILE = None
+
+
+class Profile:
+    """
+    Timers and counters collected while profiling is enabled.
+
+    ``timers`` maps a function or phase name to ``[calls, seconds]``. Timers are
+    inclusive: the time of a function contains the phases and functions it calls.
+    ``counters`` maps a counter name to its running total, e.g. ``solves``,
+    ``solve_nodes`` and ``solve_utility_cells`` (summed over the solves) or
+    ``utility_cells`` (cells written by ``calculate_utility_values``).
+    """
+
+    def __init__(self):
+        self.timers = dict()
+        self.counters = dict()
+
+    def add_time(self, name, seconds, calls=1):
+        timer = self.timers.get(name)
+        if timer is None:
+            self.timers[name] = [calls, seconds]
+        else:
+            timer[0] += calls
+            timer[1] += seconds
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def phase(self, name):
+        """Context manager timing the enclosed block under ``name``."""
+        return _Phase(self, name)
+
+    def merge(self, snapshot):
+        """Add the ``snapshot`` of another profile, e.g. of a pool worker."""
+        for name, timer in snapshot["timers"].items():
+            self.add_time(name, timer["seconds"], timer["calls"])
+        for name, value in snapshot["counters"].items():
+            self.count(name, value)
+
+    def reset(self):
+        self.timers.clear()
+        self.counters.clear()
+
+    def snapshot(self):
+        """JSON-serialisable copy of the timers and counters."""
+        return {
+            "timers": {name: {"calls": calls, "seconds": seconds}
+                       for name, (calls, seconds) in sorted(self.timers.items())},
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def to_json(self, path=None):
+        """Snapshot as a JSON string, also written to ``path`` if given."""
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            with open(path, "w") as handle:
+                handle.write(text)
+        return text
+
+    def report(self):
+        """Timers as a DataFrame sorted by total time."""
+        rows = [(name, calls, seconds, seconds / calls) for name, (calls, seconds) in self.timers.items()]
+        frame = pd.DataFrame(rows, columns=["name", "calls", "seconds", "mean"]).set_index("name")
+        return frame.sort_values("seconds", ascending=False)
+
+
+class _Phase:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+_NO_PHASE = contextlib.nullcontext()
+
+
+def _phase(name):
+    profile = _PROFILE
+    return _NO_PHASE if profile is None else _Phase(profile, name)
+
+
+def _count(name, value=1):
+    if _PROFILE is not None:
+        _PROFILE.count(name, value)
+
+
+def _count_solve(model):
+    """Count one solve of ``model`` with its node and utility cell counts."""
+    profile = _PROFILE
+    if profile is None:
+        return
+    if isinstance(model, NumpyDiagram):
+        nodes, cells = len(model.labels), model.utility[0].size
+    else:
+        nodes = model.size()
+        cells = sum(model.utility(node).domainSize() for node in model.nodes() if model.isUtilityNode(node))
+    profile.count("solves")
+    profile.count("solve_nodes", nodes)
+    profile.count("solve_utility_cells", cells)
+
+
+def profiled(function):
+    """Decorator timing ``function`` under its name while profiling is enabled."""
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = _PROFILE
+        if profile is None:
+            return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.add_time(name, time.perf_counter() - start)
+    return wrapper
+
+
+def enable_profiling(profile=None):
+    """Start collecting into ``profile`` (a new ``Profile`` by default) and return it."""
+    global _PROFILE
+    _PROFILE = profile if profile is not None else Profile()
+    return _PROFILE
+
+
+def disable_profiling():
+    """Stop collecting and return the profile that was active, if any."""
+    global _PROFILE
+    profile, _PROFILE = _PROFILE, None
+    return profile
+
+
+def profile_snapshot():
+    """Snapshot of the active profile, ``None`` while profiling is disabled."""
+    return None if _PROFILE is None else _PROFILE.snapshot()
+
+
+@contextlib.contextmanager
+def profiling(profile=None):
+    """
+    Profile the enclosed block.
+
+    Yields the ``Profile`` collecting the block; work done in process pools started
+    inside the block is merged into it. An enclosing profile receives the block's
+    timers and counters on exit.
+
+    Examples
+    --------
+    >>> with profiling() as profile:
+    ...     transfer_sweep(variables, range(1, 4), cu, pu, max_workers=4)
+    >>> profile.report()
+    """
+    global _PROFILE
+    previous = _PROFILE
+    profile = enable_profiling(profile)
+    try:
+        yield profile
+    finally:
+        _PROFILE = previous
+        if previous is not None:
+            previous.merge(profile.snapshot())
+
+
+def _init_profiled_worker(initializer, initargs):
+    enable_profiling()
+    initializer(*initargs)
+
+
+def _profiled_chunk(function, chunk):
+    # The worker's profile is shipped back with every chunk and started afresh
+    output = function(chunk)
+    snapshot = _PROFILE.snapshot()
+    _PROFILE.reset()
+    return output, snapshot
+
+@profiled
 def calculate_utility_values(model, utility_node_name, parameters):
     """
     This function computes utility values based on parent states, weights, and increments.
-    """
-    utility_node_id = model.idFromName(utility_node_name)
-    utility_parents = model.parents(utility_node_id)
-    parent_names = [model.variable(parent_id).name() for parent_id in utility_parents]
 
-    weights = []
-    increments = []
+    ``parameters`` is either the (parent, weight, increment) rows returned by
+    ``utility_parameters_from_weights`` or a ``(parent_names, weights, increments)``
+    tuple of typed arrays as returned by ``utility_arrays_from_weights``.
+    """
+    parent_names, weights, increments = _utility_parameter_arrays(parameters)
+    set_utility_table(model, utility_node_name, parent_names, weights, increments)
 
-    for parent in parent_names:
-        found = False
-        for row in parameters:
-            if row[0] == parent:
-                weights.append(float(row[1]))
-                increments.append(float(row[2]))
-                found = True
-                break
 
-        if not found:
-            raise ValueError(f"No parameters found for parent '{parent}'")
+def _utility_parameter_arrays(parameters):
+    """Normalise either accepted form of utility parameters to names and float arrays."""
+    if isinstance(parameters, tuple) and len(parameters) == 3:
+        parent_names, weights, increments = parameters
+        return list(parent_names), np.asarray(weights, dtype=float), np.asarray(increments, dtype=float)
+    parent_names = [str(row[0]) for row in parameters]
+    weights = np.array([float(row[1]) for row in parameters])
+    increments = np.array([float(row[2]) for row in parameters])
+    return parent_names, weights, increments
 
 
-    assert len(weights) == len(utility_parents), (
-        f"Number of weights must match number of parents. "
-        f"Found {len(weights)} weights for {len(utility_parents)} parents."
-    )
-    assert len(increments) == len(utility_parents), (
-        f"Number of increments must match number of parents. "
-        f"Found {len(increments)} increments for {len(utility_parents)} parents."
-    )
+def utility_table(model, utility_node_name, parent_names, weights, increments):
+    """
+    Build the additive utility tensor of a utility node with NumPy broadcasting.
 
-    utilities = {}
+    Each parent contributes ``weight * (num_states - state_index - 1) * increment``
+    and the contributions of all parents are summed over the full joint parent space.
 
-    parent_domains = {
-        parent_name: model.variable(model.idFromName(parent_name)).labels()
-        for parent_name in parent_names
-    }
+    Parameters
+    ----------
+    model : pyagrum.InfluenceDiagram
+        Influence diagram holding the utility node
+    utility_node_name : str
+        Name of the utility node
+    parent_names : sequence of str
+        Criteria the weights and increments refer to (a superset of the parents is fine)
+    weights, increments : array_like of float
+        Per-criterion weight and increment, aligned with ``parent_names``
 
-    for parent_state_combination in itertools.product(*parent_domains.values()):
-        utility_value = 0
+    Returns
+    -------
+    numpy.ndarray
+        Utility values laid out like ``model.utility(utility_node_name).toarray()``
+    """
+    weights = np.asarray(weights, dtype=float)
+    increments = np.asarray(increments, dtype=float)
+    if weights.shape != (len(parent_names),) or increments.shape != (len(parent_names),):
+        raise ValueError(
+            f"Expected {len(parent_names)} weights and increments, "
+            f"got shapes {weights.shape} and {increments.shape}"
+        )
+    index = {name: i for i, name in enumerate(parent_names)}
 
-        for i, (parent_name, state) in enumerate(zip(parent_names, parent_state_combination)):
-            num_states = len(parent_domains[parent_name])
-            state_index = parent_domains[parent_name].index(state)
+    utility_pot = model.utility(utility_node_name)
+    # toarray() axes follow the reversed variable order of the potential
+    axis_names = list(reversed(utility_pot.names))
+    shape = [utility_pot.variable(utility_pot.nbrDim() - 1 - axis).domainSize() for axis in range(len(axis_names))]
 
-            incremental_value = (num_states - state_index - 1) * increments[i]
-            weighted_value = weights[i] * incremental_value
-            utility_value += weighted_value
+    table = np.zeros(shape)
+    for axis, name in enumerate(axis_names):
+        if name == utility_node_name:
+            continue
+        if name not in index:
+            raise ValueError(f"No parameters found for parent '{name}'")
+        i = index[name]
+        num_states = shape[axis]
+        values = weights[i] * (num_states - np.arange(num_states) - 1) * increments[i]
+        broadcast_shape = [1] * len(shape)
+        broadcast_shape[axis] = num_states
+        table = table + values.reshape(broadcast_shape)
+    return table
 
-        utilities[parent_state_combination] = utility_value
 
-    for parent_state_combination, utility_value in utilities.items():
-        state_dict = {parent_name: state for parent_name, state in zip(parent_names, parent_state_combination)}
-        model.utility(utility_node_id)[state_dict] = utility_value
+def set_utility_table(model, utility_node_name, parent_names, weights, increments):
+    """Write the additive utility tensor into the utility node in one bulk assignment."""
+    with _phase("utility_table"):
+        table = utility_table(model, utility_node_name, parent_names, weights, increments)
+    _count("utility_cells", table.size)
+    # fillWith takes the values in C order of the toarray() layout; pot[:] = table would
+    # assign cell by cell from Python
+    with _phase("utility_fill"):
+        model.utility(utility_node_name).fillWith(table.ravel())
         
         
         
+@profiled
 def preference_transfer(variable_name, host_model, target_model, host_preference = {}, target_preference = {}):  
       
     host_utility_name = get_utility_nodes(host_model)[0]
@@ -96,13 +333,14 @@ def preference_transfer(variable_name, host_model, target_model, host_preference
     new_parents = list(prefs.keys())
     new_weights = pref_values / pref_values.sum()
     
-    utility_parameters = np.vstack([new_parents, new_weights, np.repeat(100,num_parents)]).T
+    utility_parameters = (new_parents, new_weights, np.repeat(100.0, num_parents))
     calculate_utility_values(target_model, target_utility_name, utility_parameters)
     #print(new_weights,new_parents)
 
     return prefs
 
 
+@profiled
 def preference_transfer2(variable_name, host_model, target_model, 
                         host_preference = {}, # This will be the full set of Patient Prefs (pu_parameters)
                         target_preference = {}, # This will be the full set of Clinician Prefs (cu_parameters)
@@ -156,7 +394,7 @@ def preference_transfer2(variable_name, host_model, target_model,
 
     # Re-calculate and set the utility values in the target model based on the combined_prefs
     # We assume 'utility_parameters_from_weights' handles the normalization.
-    utility_parameters = utility_parameters_from_weights(current_combined_prefs) 
+    utility_parameters = utility_arrays_from_weights(current_combined_prefs)
     calculate_utility_values(target_model, target_utility_name, utility_parameters)
 
     # Return the full set of combined unnormalized preferences
@@ -205,6 +443,7 @@ def get_utility_node_ids(id):
     
     
 
+@profiled
 def chance_node_transfer(variable_name, host_model, target_model):
     host_vid = host_model.idFromName(variable_name)
     host_parent_ids = host_model.parents(host_vid)
@@ -258,21 +497,183 @@ def chance_node_transfer(variable_name, host_model, target_model):
     target_cpt = target_model.cpt(variable_name)
     
     target_varnames = target_cpt.names
-    target_cpt = host_cpt.reorganize(target_varnames)
-    #print(variable_name,target_cpt)
-    target_model.cpt(variable_name)[:] = target_cpt.toarray()
+    with _phase("reorganize"):
+        target_cpt = host_cpt.reorganize(target_varnames)
+        #print(variable_name,target_cpt)
+        target_model.cpt(variable_name)[:] = target_cpt.toarray()
     
     return target_model
 
 
-def show_decision_utilities(model, evidence = {}):
+class TransferPlan:
+    """
+    Structure edits and CPTs of the chance node transfer of a set of variables.
+
+    Compiled once by ``transfer_plan``; ``apply`` replays it on a copy of the target
+    with bulk CPT writes instead of running ``chance_node_transfer`` per variable.
+
+    Attributes
+    ----------
+    variables : frozenset of str
+    nodes : list of tuple
+        ``(name, kind, variable)`` of the nodes added to the target
+    erased, added : list of tuple
+        ``(tail, head)`` names of the arcs erased from and added to the target
+    cpts : dict
+        Transferred variable mapped to ``(names, values)``, the CPT variable order and
+        the flat ``toarray()`` values
+    sizes : dict
+        Domain size of the variables of the CPTs
+    """
+
+    def __init__(self, variables, nodes, erased, added, cpts, sizes):
+        self.variables = frozenset(variables)
+        self.nodes = nodes
+        self.erased = erased
+        self.added = added
+        self.cpts = cpts
+        self.sizes = sizes
+        self._layouts = dict()
+
+    @classmethod
+    def merge(cls, plans):
+        """Plan of the union of the variables of plans compiled against the same target."""
+        nodes, erased, added, cpts, sizes = dict(), dict(), dict(), dict(), dict()
+        for plan in plans:
+            nodes.update((node[0], node) for node in plan.nodes)
+            erased.update(dict.fromkeys(plan.erased))
+            added.update(dict.fromkeys(plan.added))
+            cpts.update(plan.cpts)
+            sizes.update(plan.sizes)
+        variables = frozenset().union(*(plan.variables for plan in plans))
+        return cls(variables, list(nodes.values()), list(erased), list(added), cpts, sizes)
+
+    def _values(self, name, names):
+        plan_names, values = self.cpts[name]
+        if names == plan_names:
+            return values
+        key = (name, names)
+        layout = self._layouts.get(key)
+        if layout is None:
+            # Same variables in another order, e.g. when the target already had some arcs
+            axes = list(reversed(plan_names))
+            table = values.reshape([self.sizes[axis] for axis in axes])
+            layout = np.ascontiguousarray(table.transpose([axes.index(axis) for axis in reversed(names)])).ravel()
+            self._layouts[key] = layout
+        return layout
+
+    def apply(self, target_model):
+        """Transfer the plan's variables onto ``target_model`` in place and return it."""
+        with _phase("plan_apply"):
+            new = []
+            for name, kind, variable in self.nodes:
+                if target_model.exists(name):
+                    continue
+                if kind == "decision":
+                    target_model.addDecisionNode(variable)
+                else:
+                    target_model.addChanceNode(variable)
+                    new.append(name)
+            for tail, head in self.erased:
+                if target_model.existsArc(tail, head):
+                    target_model.eraseArc(tail, head)
+            for tail, head in self.added:
+                if not target_model.existsArc(tail, head):
+                    target_model.addArc(tail, head)
+            for name in new:
+                if name not in self.cpts:
+                    cpt = target_model.cpt(name)
+                    cpt.fillWith(np.repeat(1 / cpt.domainSize(), cpt.domainSize()))
+            for name in self.cpts:
+                cpt = target_model.cpt(name)
+                cpt.fillWith(self._values(name, tuple(cpt.names)))
+        return target_model
+
+
+def compile_transfer_plan(variable_name, host_model, target_model):
+    """
+    Plan of ``chance_node_transfer(variable_name, host_model, target_model)``.
+
+    The transfer runs once on a copy of the target and the difference to the target is
+    recorded.
+    """
+    with _phase("plan_compile"):
+        model = gum.InfluenceDiagram(target_model)
+        chance_node_transfer(variable_name, host_model, model)
+
+        nodes = []
+        for node in sorted(model.nodes()):
+            name = model.variable(node).name()
+            if not target_model.exists(name):
+                kind = "decision" if model.isDecisionNode(node) else "chance"
+                nodes.append((name, kind, model.variable(node).clone()))
+
+        def arcs(diagram):
+            return {(diagram.variable(tail).name(), diagram.variable(head).name()) for tail, head in diagram.arcs()}
+        before, after = arcs(target_model), arcs(model)
+        erased = sorted(before - after)
+        # Parents are added in CPT order so the target CPT gets the same variable order
+        added = [(parent, name) for name in sorted({head for _, head in after - before})
+                 for parent in list(model.cpt(name).names)[1:] if (parent, name) not in before]
+
+        cpt = model.cpt(variable_name)
+        cpts = {variable_name: (tuple(cpt.names), cpt.toarray().ravel().copy())}
+        sizes = {name: model.variableFromName(name).domainSize() for name in cpt.names}
+    return TransferPlan((variable_name,), nodes, erased, added, cpts, sizes)
+
+
+def transfer_plan(variables, host_model, target_model, plans=None):
+    """
+    ``TransferPlan`` of transferring ``variables`` from the host to the target.
+
+    Plans are compiled per variable against ``target_model`` and merged per variable
+    set. Applying the plan to a copy of ``target_model``, or to a copy on which other
+    variables were already transferred, gives the diagram of calling
+    ``chance_node_transfer`` for each variable.
+
+    Parameters
+    ----------
+    plans : dict, optional
+        Plans of earlier calls on the same two models, keyed by variable set and
+        extended by this call. Plans are compiled from the content of the models, so a
+        dict must only be shared while neither model is edited, e.g. within one sweep
+        on models built for it.
+    """
+    variables = frozenset(variables)
+    if plans is None:
+        plans = dict()
+    plan = plans.get(variables)
+    if plan is None:
+        if len(variables) == 1:
+            plan = compile_transfer_plan(next(iter(variables)), host_model, target_model)
+        else:
+            plan = TransferPlan.merge([transfer_plan((name,), host_model, target_model, plans)
+                                       for name in sorted(variables)])
+        plans[variables] = plan
+    return plan
+
+
+@profiled
+def show_decision_utilities(model, evidence = {}, cache=None, backend="limid", bounds=None):
     """
     Calculate expected utilities for all decision states and identify the optimal choice.
     
     Parameters
     ----------
-    model : pyagrum.InfluenceDiagram
+    model : pyagrum.InfluenceDiagram or NumpyDiagram
         Influence diagram with exactly one decision node
+    cache : DecisionCache, optional
+        Memoizes results by model fingerprint and evidence
+    backend : {"limid", "numpy", "sampling"}
+        ``"limid"`` solves with ``ShaferShenoyLIMIDInference``, ``"numpy"`` with the
+        variable elimination of ``NumpyDiagram`` (used instead of ``"limid"`` for a
+        ``NumpyDiagram``), ``"sampling"`` estimates the utilities with
+        ``sample_decision_utilities`` until the optimal choice is separated
+    bounds : dict, optional
+        Receives the error bounds of the result: ``half_width`` and ``gap_half_width``
+        (decision states mapped to their confidence half-widths, see
+        ``sample_decision_utilities``), ``samples`` and ``separated``; exact backends
+        report half-widths of 0
         
     Returns
     -------
@@ -281,54 +682,3206 @@ def show_decision_utilities(model, evidence = {}):
         - float: Maximum expected utility value  
         - str: Optimal decision state label
     """
-    decision_nodes = [node for node in model.nodes() if model.isDecisionNode(node)]
-    decision_node_id = decision_nodes[0]
-    decision_node = model.variable(decision_node_id)
-    decision_name = decision_node.name()
-    decision_labels =   decision_node.labels()
+    if isinstance(model, NumpyDiagram) and backend == "limid":
+        backend = "numpy"
+    if backend not in ("limid", "numpy", "sampling"):
+        raise ValueError(f"Unknown backend '{backend}'")
 
-    limid = ShaferShenoyLIMIDInference(model)
-    limid.makeInference()
-    limid.setEvidence(evidence)
-    post_utility = limid.posteriorUtility(decision_name).toarray()
+    if cache is not None:
+        key = (model_fingerprint(model), _evidence_key(evidence), backend)
+        cached = cache.get(key)
+        _count("cache_hits" if cached is not None else "cache_misses")
+        if cached is not None:
+            state_utilities, max_expected_utility, max_utility_state, errors = cached
+            if bounds is not None:
+                bounds.update(_thawed_bounds(errors))
+            return dict(state_utilities), max_expected_utility, max_utility_state
+
+    errors = None
+    if backend == "sampling":
+        compiled = model if isinstance(model, NumpyDiagram) else NumpyDiagram(model)
+        decision_labels = compiled.decision_labels
+        _count_solve(compiled)
+        with _phase("sampling"):
+            sampled = sample_decision_utilities(compiled, evidence)
+        post_utility = sampled["utilities"]
+        errors = {
+            "half_width": dict(zip(decision_labels, sampled["half_width"].tolist())),
+            "gap_half_width": dict(zip(decision_labels, sampled["gap_half_width"].tolist())),
+            "samples": sampled["samples"],
+            "separated": sampled["separated"],
+        }
+    elif backend == "numpy":
+        compiled = model if isinstance(model, NumpyDiagram) else NumpyDiagram(model)
+        decision_labels = compiled.decision_labels
+        _count_solve(compiled)
+        with _phase("numpy_solve"):
+            post_utility = compiled.decision_utilities(evidence)
+    else:
+        decision_nodes = [node for node in model.nodes() if model.isDecisionNode(node)]
+        decision_node_id = decision_nodes[0]
+        decision_node = model.variable(decision_node_id)
+        decision_name = decision_node.name()
+        decision_labels =   decision_node.labels()
+
+        _count_solve(model)
+        with _phase("engine_build"):
+            limid = ShaferShenoyLIMIDInference(model)
+        limid.setEvidence(evidence)
+        with _phase("make_inference"):
+            limid.makeInference()
+        post_utility = limid.posteriorUtility(decision_name).toarray()
     
     state_utilities = dict(zip(decision_labels, post_utility.tolist()))
     max_expected_utility = np.max(post_utility)
     max_utility_state = decision_labels[np.argmax(post_utility)]
+    if errors is None:
+        zeros = dict.fromkeys(decision_labels, 0.0)
+        errors = {"half_width": zeros, "gap_half_width": dict(zeros), "samples": 0, "separated": True}
+    if bounds is not None:
+        bounds.update(errors)
 
+    if cache is not None:
+        cache.put(key, (dict(state_utilities), max_expected_utility, max_utility_state, _frozen_bounds(errors)))
     return state_utilities, max_expected_utility, max_utility_state
 
 
-def utility_parameters_from_weights(prefs):
-    """Temporary function to be compatible with Zeliha's weights"""
-    num_parents = len(prefs)    
-    parents = list(prefs.keys())    
-    pref_values = np.array(list(prefs.values()))    
-    weights = pref_values / pref_values.sum() 
-    return np.vstack([parents, weights, np.repeat(100,num_parents)]).T
+def _frozen_bounds(errors):
+    """Error bounds as nested tuples, so cache hits cannot share mutable dicts."""
+    return tuple((name, tuple(value.items()) if isinstance(value, dict) else value) for name, value in errors.items())
 
 
+def _thawed_bounds(frozen):
+    """Fresh error bound dicts from ``_frozen_bounds``."""
+    return {name: dict(value) if isinstance(value, tuple) else value for name, value in frozen}
 
-def voe(id):
-    """"
-    Compute value of evidence per state for each non-decision, non-utility node.
-    Uses Shafer–Shenoy LIMID inference to compare base MEU to MEU with each node clamped,
-    returning a DataFrame of {node, label, utility_delta} sorted by utility (desc).
+
+def _model_snapshot(model):
+    """Node ids, arcs and copies of the CPTs and utility tables of ``model``."""
+    tables = dict()
+    for node in model.nodes():
+        if model.isChanceNode(node):
+            tables[node] = gum.Potential(model.cpt(node))
+        elif model.isUtilityNode(node):
+            tables[node] = gum.Potential(model.utility(node))
+    return model.nodes(), model.arcs(), tables
+
+
+def _snapshot_matches(model, snapshot):
+    """Whether ``model`` still has the structure and table contents of ``_model_snapshot``."""
+    nodes, arcs, tables = snapshot
+    if model.nodes() != nodes or model.arcs() != arcs:
+        return False
+    # Potential equality is evaluated by pyAgrum, far cheaper than exporting the tables
+    return all((model.cpt(node) if model.isChanceNode(node) else model.utility(node)) == table
+               for node, table in tables.items())
+
+
+class InferenceSession:
     """
-    res = []
-    limid = ShaferShenoyLIMIDInference(id)
-    limid.setEvidence({})
-    limid.makeInference()
-    base_utility = limid.MEU()["mean"]
-    node_names = id.names()
-    for node_name in node_names:
-        node = id.variableFromName(node_name)
-        if id.isDecisionNode(node_name) or id.isUtilityNode(node_name):
+    LIMID inference engine bound to one influence diagram and kept alive across calls.
+
+    Swapping evidence reuses the compiled ``ShaferShenoyLIMIDInference`` and results
+    are memoized per evidence. Every query compares the structure, CPTs and utility
+    tables of the model with a copy taken when the engine was built, so the engine and
+    the results are rebuilt after any edit of the model, including direct pyAgrum edits
+    such as ``model.cpt(name).fillWith(...)``; ``invalidate`` drops them explicitly.
+
+    Parameters
+    ----------
+    model : pyagrum.InfluenceDiagram
+        Influence diagram with exactly one decision node
+    evidence : dict
+        Initial evidence
+    """
+
+    def __init__(self, model, evidence={}):
+        self.model = model
+        self.evidence = dict(evidence)
+        self._limid = None
+        self._snapshot = None
+        self._engine_evidence = None
+        self._solved = False
+        self._results = dict()
+
+    def invalidate(self):
+        """Drop the engine and the memoized results."""
+        self._limid = None
+        self._results.clear()
+
+    def _check_model(self):
+        """Drop the engine and the results if the model changed since the engine was built."""
+        if self._limid is not None and not _snapshot_matches(self.model, self._snapshot):
+            self.invalidate()
+
+    def _engine(self, evidence, checked=False):
+        """Engine solved on ``evidence``; ``checked`` when ``_check_model`` just ran."""
+        if not checked:
+            self._check_model()
+        if self._limid is None:
+            with _phase("engine_build"):
+                self._limid = ShaferShenoyLIMIDInference(self.model)
+            self._snapshot = _model_snapshot(self.model)
+            self._engine_evidence = None
+            self._results.clear()
+            decision_nodes = [node for node in self.model.nodes() if self.model.isDecisionNode(node)]
+            decision = self.model.variable(decision_nodes[0])
+            self.decision_name = decision.name()
+            self.decision_labels = list(decision.labels())
+        if self._engine_evidence != evidence:
+            self._limid.setEvidence(evidence)
+            self._engine_evidence = dict(evidence)
+            self._solved = False
+        if not self._solved:
+            _count_solve(self.model)
+            with _phase("make_inference"):
+                self._limid.makeInference()
+            self._solved = True
+        return self._limid
+
+    def set_evidence(self, evidence):
+        """Replace the session evidence; inference runs lazily on the next query."""
+        self.evidence = dict(evidence)
+
+    def _solve(self, evidence):
+        evidence = self.evidence if evidence is None else dict(evidence)
+        self._check_model()
+        key = _evidence_key(evidence)
+        cached = self._results.get(key)
+        if cached is not None:
+            return cached
+        limid = self._engine(evidence, checked=True)
+        post_utility = limid.posteriorUtility(self.decision_name).toarray()
+        self._results[key] = (post_utility, limid.MEU()["mean"])
+        return self._results[key]
+
+    def decision_utilities(self, evidence=None):
+        """``show_decision_utilities`` output for the session (or the given) evidence."""
+        post_utility, _ = self._solve(evidence)
+        state_utilities = dict(zip(self.decision_labels, post_utility.tolist()))
+        return state_utilities, np.max(post_utility), self.decision_labels[np.argmax(post_utility)]
+
+    def meu(self, evidence=None):
+        """Maximum expected utility for the session (or the given) evidence."""
+        return self._solve(evidence)[1]
+
+    def voe(self, nodes=None):
+        """``voe_analysis`` output for the session evidence, solved on the session engine."""
+        limid = self._engine(self.evidence)
+        nodes, pairs, priors, base_utility = _voe_pairs(self.model, limid, self.evidence, nodes)
+        meus = _clamped_meus(self.model, limid, self.evidence, pairs)
+        # The engine was left on the last clamp
+        self._engine_evidence = None
+        return _voe_result(nodes, pairs, priors, meus, base_utility)
+
+
+def model_fingerprint(model):
+    """
+    Canonical content hash of an influence diagram.
+
+    The hash covers node names and kinds, variable domains, arcs and the CPT and
+    utility arrays, laid out in a name-sorted variable order so that two diagrams
+    built in a different node or arc order hash identically.
+
+    Returns
+    -------
+    str
+        Hexadecimal digest
+    """
+    if isinstance(model, NumpyDiagram):
+        return model.fingerprint
+    digest = hashlib.blake2b(digest_size=20)
+    for name in sorted(model.names()):
+        if model.isDecisionNode(name):
+            kind, table = "decision", None
+        elif model.isUtilityNode(name):
+            kind, table = "utility", model.utility(name)
+        else:
+            kind, table = "chance", model.cpt(name)
+        parents = sorted(model.variable(parent).name() for parent in model.parents(name))
+        labels = model.variableFromName(name).labels()
+        digest.update(repr((name, kind, labels, parents)).encode())
+        if table is not None:
+            order = [name] + parents
+            values = np.ascontiguousarray(table.reorganize(order).toarray(), dtype=float)
+            digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def _evidence_key(evidence):
+    """Hashable, order independent form of an evidence dict."""
+    return tuple(sorted(
+        (str(node), tuple(value) if isinstance(value, (list, tuple, np.ndarray)) else value)
+        for node, value in evidence.items()
+    ))
+
+
+_EINSUM_PATHS = dict()
+
+
+_EINSUM_LETTERS = "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _contract_named(operands, output, letters, free=None):
+    """
+    Contract ``(array, axis_names)`` operands onto ``output`` with einsum ``letters`` per name.
+
+    The elimination order is cached per shape, ignoring the size of the ``free`` axis
+    (e.g. a batch axis), so batches of any size share it.
+    """
+    subscripts = ",".join("".join(letters[name] for name in axes) for _, axes in operands)
+    subscripts += "->" + "".join(letters[name] for name in output)
+    arrays = [array for array, _ in operands]
+    # Elimination orders are shared by all diagrams with the same structure
+    key = (subscripts, tuple(tuple(-1 if name == free else size for name, size in zip(axes, array.shape))
+                             for array, axes in operands))
+    path = _EINSUM_PATHS.get(key)
+    if path is None:
+        if len(_EINSUM_PATHS) >= 4096:
+            _EINSUM_PATHS.clear()
+        path = np.einsum_path(subscripts, *arrays, optimize="greedy")[0]
+        _EINSUM_PATHS[key] = path
+    return np.einsum(subscripts, *arrays, optimize=path)
+
+
+class NumpyDiagram:
+    """
+    NumPy export of an influence diagram with one decision node and one utility node.
+
+    The CPTs and the utility table are copied to arrays once; expected utilities per
+    decision state are then computed by ``einsum`` based variable elimination over the
+    chance nodes that are ancestors of the utility node or of the evidence. Results
+    match ``ShaferShenoyLIMIDInference`` with the evidence set before inference; the
+    decision node must not have parents.
+
+    Attributes
+    ----------
+    decision_name : str
+    decision_labels : list of str
+    utility_name : str
+    labels : dict
+        Labels of every chance and decision variable
+    parents : dict
+        Parent names of every chance node
+    cpts : dict
+        Chance node name mapped to ``(array, axis_names)``
+    utility : tuple
+        ``(array, axis_names)`` of the utility table, without the utility variable axis
+    """
+
+    def __init__(self, model):
+        decision_nodes = [node for node in model.nodes() if model.isDecisionNode(node)]
+        utility_nodes = get_utility_node_ids(model)
+        if len(decision_nodes) != 1 or len(utility_nodes) != 1:
+            raise ValueError("NumpyDiagram requires exactly one decision node and one utility node")
+        decision_id = decision_nodes[0]
+        if len(model.parents(decision_id)) > 0:
+            raise ValueError("NumpyDiagram requires a decision node without parents")
+
+        self.decision_name = model.variable(decision_id).name()
+        self.decision_labels = list(model.variable(decision_id).labels())
+        self.utility_name = model.variable(utility_nodes[0]).name()
+        self.labels = {self.decision_name: self.decision_labels}
+        self.parents = dict()
+        self.cpts = dict()
+        for name in sorted(model.names()):
+            if not model.isChanceNode(name):
+                continue
+            self.labels[name] = list(model.variableFromName(name).labels())
+            self.parents[name] = [model.variable(parent).name() for parent in model.parents(name)]
+            cpt = model.cpt(name)
+            self.cpts[name] = (cpt.toarray().copy(), tuple(reversed(cpt.names)))
+
+        utility_pot = model.utility(self.utility_name)
+        axes = tuple(reversed(utility_pot.names))
+        table = utility_pot.toarray()
+        keep = tuple(name for name in axes if name != self.utility_name)
+        self.utility = (table.reshape([len(self.labels[name]) for name in keep]), keep)
+        self._model = model
+        self._fingerprint = None
+
+        names = [self.decision_name] + list(self.cpts)
+        if len(names) > len(_EINSUM_LETTERS):
+            raise ValueError(f"NumpyDiagram supports at most {len(_EINSUM_LETTERS)} variables, got {len(names)}")
+        self._letters = dict(zip(names, _EINSUM_LETTERS))
+
+    @property
+    def fingerprint(self):
+        """``model_fingerprint`` of the exported diagram, computed on first use."""
+        if self._fingerprint is None:
+            self._fingerprint = model_fingerprint(self._model)
+            self._model = None
+        return self._fingerprint
+
+    def _relevant(self, roots):
+        """Chance nodes that are ancestors of (or equal to) ``roots``."""
+        relevant = set()
+        stack = [name for name in roots if name in self.cpts]
+        while stack:
+            name = stack.pop()
+            if name in relevant:
+                continue
+            relevant.add(name)
+            stack.extend(parent for parent in self.parents[name] if parent in self.cpts)
+        return [name for name in self.cpts if name in relevant]
+
+    def evidence_vector(self, name, value):
+        """Likelihood vector of a label, a state index or a soft-evidence list."""
+        if name not in self.cpts:
+            raise ValueError(f"Evidence on '{name}', which is not a chance node of the model")
+        size = len(self.labels[name])
+        if isinstance(value, str) and value not in self.labels[name]:
+            raise ValueError(f"Label '{value}' is unknown in '{name}' {self.labels[name]}")
+        if isinstance(value, str):
+            vector = np.zeros(size)
+            vector[self.labels[name].index(value)] = 1.0
+            return vector
+        if isinstance(value, (bool, np.bool_)):
+            raise ValueError(f"Evidence on '{name}' must be a label, a state index or {size} values, got {value}")
+        if isinstance(value, (int, np.integer)):
+            if not 0 <= value < size:
+                raise ValueError(f"State index {value} is out of range for '{name}' with {size} states")
+            vector = np.zeros(size)
+            vector[value] = 1.0
+            return vector
+        vector = np.asarray(value, dtype=float)
+        if vector.shape != (size,):
+            raise ValueError(f"Evidence on '{name}' must have {size} values")
+        if not np.all(np.isfinite(vector)):
+            raise ValueError(f"Evidence on '{name}' must have finite values")
+        return vector
+
+    def _contract(self, operands, output):
+        """Contract ``(array, axis_names)`` operands onto the ``output`` names."""
+        return _contract_named(operands, output, self._letters)
+
+    def _factors(self, evidence, roots, cpts=None, likelihoods=None):
+        # cpts can replace the compiled CPTs, e.g. by sampled ones with an extra axis, and
+        # likelihoods the evidence vectors, e.g. by a batch of them
+        cpts = self.cpts if cpts is None else cpts
+        if likelihoods is None:
+            likelihoods = {name: (self.evidence_vector(name, value), (name,)) for name, value in evidence.items()}
+        relevant = self._relevant(list(roots) + list(evidence))
+        # Factors disconnected from the decision and the roots are independent of them
+        # and cancel out, as in the junction tree of ShaferShenoyLIMIDInference
+        component = {self.decision_name, *roots}
+        included = set()
+        changed = True
+        while changed:
+            changed = False
+            for name in relevant:
+                axes = self.cpts[name][1]
+                if name not in included and component.intersection(axes):
+                    component.update(axes)
+                    included.add(name)
+                    changed = True
+        operands = [cpts[name] for name in relevant if name in included]
+        decision_size = len(self.decision_labels)
+        operands.append((np.ones(decision_size), (self.decision_name,)))
+        for name, likelihood in likelihoods.items():
+            if name in component:
+                operands.append(likelihood)
+        return operands
+
+    def decision_utilities(self, evidence={}):
+        """
+        Expected utility of each decision state given ``evidence``.
+
+        Decision states whose evidence has zero probability get utility 0, as in
+        ``ShaferShenoyLIMIDInference``.
+        """
+        utility_array, utility_axes = self.utility
+        operands = self._factors(evidence, utility_axes)
+        decision = (self.decision_name,)
+        numerator = self._contract(operands + [self.utility], decision)
+        denominator = self._contract(operands, decision)
+        return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+    def meu(self, evidence={}):
+        """Maximum expected utility given ``evidence``."""
+        return float(np.max(self.decision_utilities(evidence)))
+
+    def posterior(self, name, evidence={}):
+        """
+        Distribution of a chance node for each decision state given ``evidence``.
+
+        Returns
+        -------
+        numpy.ndarray
+            ``(decision states, states of name)``; rows of decision states whose evidence
+            has zero probability are 0
+        """
+        operands = self._factors(evidence, [name])
+        decision = (self.decision_name,)
+        joint = self._contract(operands, decision + (name,))
+        denominator = self._contract(operands, decision)[:, None]
+        return np.divide(joint, denominator, out=np.zeros_like(joint), where=denominator > 0)
+
+
+def _compiled_model(model):
+    return model if isinstance(model, NumpyDiagram) else NumpyDiagram(model)
+
+
+def cpt_parameters(model, nodes=None):
+    """
+    Sensitivity parameters ``(node, label, parents)`` of the CPT entries of ``nodes``.
+
+    ``parents`` maps every parent of the node to a label. There is one parameter per
+    state but the last of every CPT row, so binary nodes give one parameter per parent
+    configuration. By default the ancestors of the utility node are used.
+    """
+    compiled = _compiled_model(model)
+    if nodes is None:
+        nodes = compiled._relevant(compiled.utility[1])
+    parameters = []
+    for name in nodes:
+        parent_axes = compiled.cpts[name][1][:-1]
+        for row in itertools.product(*(compiled.labels[parent] for parent in parent_axes)):
+            parents = dict(zip(parent_axes, row))
+            parameters.extend((name, label, parents) for label in compiled.labels[name][:-1])
+    return parameters
+
+
+def _parameter_entry(compiled, parameter):
+    """CPT row index, state index and current value of a sensitivity parameter."""
+    name, label, parents = parameter
+    if name not in compiled.cpts:
+        raise ValueError(f"'{name}' is not a chance node of the model")
+    array, axes = compiled.cpts[name]
+    if set(parents) != set(axes[:-1]):
+        raise ValueError(f"Parameter of '{name}' must give a label for each parent {list(axes[:-1])}")
+    row = tuple(compiled.labels[parent].index(parents[parent]) for parent in axes[:-1])
+    state = compiled.labels[name].index(label)
+    return row, state, float(array[row + (state,)])
+
+
+def _perturbed_cpt(array, row, state, value):
+    """Copy of ``array`` with one entry set to ``value`` and the rest of its row rescaled."""
+    table = array.copy()
+    entries = table[row]
+    others = np.arange(len(entries)) != state
+    rest = entries[others].sum()
+    if rest > 0:
+        entries[others] *= (1.0 - value) / rest
+    else:
+        entries[others] = (1.0 - value) / others.sum()
+    entries[state] = value
+    return table
+
+
+def _corner_terms(compiled, parameters, evidence):
+    """
+    Numerator and denominator of the decision utilities at the corners of the unit box.
+
+    An entry and the rescaled rest of its row are linear in the entry's value, and a
+    CPT row enters every term of the joint once, so both are multilinear in the
+    parameters and the corners determine them exactly.
+
+    Returns
+    -------
+    tuple of numpy.ndarray
+        ``(2,) * len(parameters) + (decision states,)`` numerators and denominators
+    """
+    entries = [(parameter[0],) + _parameter_entry(compiled, parameter)[:2] for parameter in parameters]
+    if len(set((name, row) for name, row, _ in entries)) < len(entries):
+        raise ValueError("Sensitivity parameters must lie in different CPT rows")
+    shape = (2,) * len(parameters) + (len(compiled.decision_labels),)
+    numerators, denominators = np.empty(shape), np.empty(shape)
+    view = copy.copy(compiled)
+    for corner in itertools.product((0, 1), repeat=len(parameters)):
+        view.cpts = dict(compiled.cpts)
+        for (name, row, state), value in zip(entries, corner):
+            array, axes = view.cpts[name]
+            view.cpts[name] = (_perturbed_cpt(array, row, state, float(value)), axes)
+        operands = view._factors(evidence, compiled.utility[1])
+        decision = (compiled.decision_name,)
+        numerators[corner] = view._contract(operands + [compiled.utility], decision)
+        denominators[corner] = view._contract(operands, decision)
+    return numerators, denominators
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def _flip_points(numerators, denominators):
+    """
+    Values in [0, 1] of a one-way parameter at which the optimal decision state changes.
+
+    ``numerators`` and ``denominators`` are the ``(2, decision states)`` corner terms;
+    the utility of each state is ``(a + b p) / (c + e p)``, so two states tie at the
+    roots of a quadratic.
+    """
+    a, b = numerators[0], numerators[1] - numerators[0]
+    c, e = denominators[0], denominators[1] - denominators[0]
+    points = {0.0, 1.0}
+    for d, k in itertools.combinations(range(len(a)), 2):
+        coefficients = [b[d] * e[k] - b[k] * e[d],
+                        a[d] * e[k] + b[d] * c[k] - a[k] * e[d] - b[k] * c[d],
+                        a[d] * c[k] - a[k] * c[d]]
+        if not np.any(coefficients):
             continue
-        labels = node.labels()
-        for label in labels: 
-            limid.setEvidence({node_name: label})
-            limid.makeInference()
-            utility = limid.MEU()["mean"]
-            res.append({"node": node_name, "label": label, "utility": utility - base_utility})
-    return pd.DataFrame.from_dict(res).sort_values('utility', ascending=False)
\ No newline at end of file
+        for root in np.roots(coefficients):
+            if abs(root.imag) < 1e-12 and 0.0 < root.real < 1.0:
+                points.add(float(root.real))
+    points = sorted(points)
+    middles = np.array([(low + high) / 2 for low, high in zip(points[:-1], points[1:])])
+    best = np.argmax(_ratio(a + middles[:, None] * b, c + middles[:, None] * e), axis=1)
+    return [(points[i + 1], int(best[i]), int(best[i + 1])) for i in range(len(best) - 1) if best[i] != best[i + 1]]
+
+
+@profiled
+def one_way_sensitivity(model, parameter, evidence={}, grid=101):
+    """
+    Decision utilities over the range of one CPT entry and its decision-flip thresholds.
+
+    The entry is set to every grid value and the other entries of its distribution are
+    rescaled to keep their proportions. The utilities are a linear fraction of the value
+    (see ``_corner_terms``), so two solves give the whole grid and the thresholds
+    exactly.
+
+    Parameters
+    ----------
+    model : pyagrum.InfluenceDiagram or NumpyDiagram
+        Diagram with its utilities set, e.g. from ``build_cid``
+    parameter : tuple
+        ``(node, label, parents)`` as returned by ``cpt_parameters``
+    evidence : dict
+    grid : int or array_like
+        Number of equally spaced values in [0, 1], or the values
+
+    Returns
+    -------
+    dict
+        ``values``, ``utilities`` (values, decision states), ``decision`` (state index
+        per value), ``decision_labels``, ``base`` (current value) and ``thresholds``
+        (list of ``(value, from_label, to_label)`` in increasing value)
+    """
+    compiled = _compiled_model(model)
+    base = _parameter_entry(compiled, parameter)[2]
+    values = np.linspace(0.0, 1.0, grid) if np.isscalar(grid) else np.asarray(grid, dtype=float)
+    numerators, denominators = _corner_terms(compiled, [parameter], evidence)
+    weights = np.stack([1.0 - values, values], axis=1)
+    utilities = _ratio(weights @ numerators, weights @ denominators)
+    labels = compiled.decision_labels
+    return {
+        "values": values,
+        "utilities": utilities,
+        "decision": np.argmax(utilities, axis=1),
+        "decision_labels": list(labels),
+        "base": base,
+        "thresholds": [(value, labels[before], labels[after])
+                       for value, before, after in _flip_points(numerators, denominators)],
+    }
+
+
+@profiled
+def two_way_sensitivity(model, first, second, evidence={}, grid=51):
+    """
+    Decision utilities over a grid of two CPT entries in different CPT rows.
+
+    Entries are varied as in ``one_way_sensitivity``. The numerator and denominator of
+    the utilities are bilinear in the two values, so four solves give the whole grid.
+
+    Returns
+    -------
+    dict
+        ``values`` (pair of grids), ``utilities`` (first values, second values, decision
+        states), ``decision``, ``decision_labels``, ``base`` (pair of current values) and
+        ``thresholds``: for every value of the second parameter, the thresholds of the
+        first as in ``one_way_sensitivity``
+    """
+    compiled = _compiled_model(model)
+    base = (_parameter_entry(compiled, first)[2], _parameter_entry(compiled, second)[2])
+    values = np.linspace(0.0, 1.0, grid) if np.isscalar(grid) else np.asarray(grid, dtype=float)
+    numerators, denominators = _corner_terms(compiled, [first, second], evidence)
+    weights = np.stack([1.0 - values, values], axis=1)
+    numerator = np.einsum("ip,jq,pqd->ijd", weights, weights, numerators)
+    denominator = np.einsum("ip,jq,pqd->ijd", weights, weights, denominators)
+    utilities = _ratio(numerator, denominator)
+    labels = compiled.decision_labels
+    thresholds = []
+    for q in weights:
+        flips = _flip_points(np.einsum("q,pqd->pd", q, numerators), np.einsum("q,pqd->pd", q, denominators))
+        thresholds.append([(value, labels[before], labels[after]) for value, before, after in flips])
+    return {
+        "values": (values, values),
+        "utilities": utilities,
+        "decision": np.argmax(utilities, axis=2),
+        "decision_labels": list(labels),
+        "base": base,
+        "thresholds": thresholds,
+    }
+
+
+@profiled
+def tornado(model, parameters=None, evidence={}, spread=0.1):
+    """
+    Tornado ranking of CPT entries by their effect on the recommended treatment.
+
+    Every parameter is moved ``spread`` below and above its current value (within
+    [0, 1]) as in ``one_way_sensitivity``. The swing is the change of the expected
+    utility of the currently optimal treatment over that range; the nearest threshold
+    tells how far the entry can move before the recommendation flips.
+
+    Parameters
+    ----------
+    model : pyagrum.InfluenceDiagram or NumpyDiagram
+    parameters : list of tuple, optional
+        ``cpt_parameters`` of the model by default
+    evidence : dict
+    spread : float
+        Absolute perturbation of the entries
+
+    Returns
+    -------
+    pandas.DataFrame
+        One row per parameter, largest swing first: ``node``, ``label``, ``parents``,
+        ``base``, ``low``, ``high``, ``utility_low``, ``utility_high``, ``swing``,
+        ``threshold`` (nearest flip value, NaN if none), ``distance`` to it,
+        ``flip_to`` and ``flips`` (whether it lies within the range)
+    """
+    compiled = _compiled_model(model)
+    if parameters is None:
+        parameters = cpt_parameters(compiled)
+    optimal = int(np.argmax(compiled.decision_utilities(evidence)))
+    rows = []
+    for parameter in parameters:
+        name, label, parents = parameter
+        base = _parameter_entry(compiled, parameter)[2]
+        low, high = max(0.0, base - spread), min(1.0, base + spread)
+        numerators, denominators = _corner_terms(compiled, [parameter], evidence)
+        weights = np.array([[1.0 - low, low], [1.0 - high, high]])
+        utility_low, utility_high = _ratio(weights @ numerators, weights @ denominators)[:, optimal]
+        flips = _flip_points(numerators, denominators)
+        nearest = min(flips, key=lambda flip: abs(flip[0] - base)) if flips else (np.nan, optimal, optimal)
+        rows.append({
+            "node": name,
+            "label": label,
+            "parents": ", ".join(f"{parent}={value}" for parent, value in parents.items()),
+            "base": base,
+            "low": low,
+            "high": high,
+            "utility_low": utility_low,
+            "utility_high": utility_high,
+            "swing": abs(utility_high - utility_low),
+            "threshold": nearest[0],
+            "distance": abs(nearest[0] - base),
+            # Below the base value the decision on the far side of the threshold is the earlier one
+            "flip_to": compiled.decision_labels[nearest[1] if nearest[0] < base else nearest[2]] if flips else None,
+            "flips": bool(flips) and low <= nearest[0] <= high,
+        })
+    frame = pd.DataFrame(rows)
+    return frame.sort_values("swing", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def normalised_weights(weights, criteria):
+    """
+    Normalised weight rows aligned with ``criteria``.
+
+    ``weights`` is a preference dict (normalised over all its values, like
+    ``utility_parameters_from_weights``; absent criteria weigh 0), a list of such
+    dicts, or an array of unnormalised weights with one column per criterion.
+    """
+    if isinstance(weights, dict):
+        weights = [weights]
+    if isinstance(weights, (list, tuple)) and weights and isinstance(weights[0], dict):
+        rows = np.array([[prefs.get(name, 0.0) for name in criteria] for prefs in weights], dtype=float)
+        totals = np.array([sum(prefs.values()) for prefs in weights], dtype=float)
+        return rows / totals[:, None]
+    rows = np.atleast_2d(np.asarray(weights, dtype=float))
+    if rows.shape[1] != len(criteria):
+        raise ValueError(f"Expected {len(criteria)} weight columns, got {rows.shape[1]}")
+    return rows / rows.sum(axis=1, keepdims=True)
+
+
+class UtilityDecomposition:
+    """
+    Per-criterion expected scores of a model with an additive utility.
+
+    The utility built by ``calculate_utility_values`` is a weighted sum over criteria of
+    ``(num_states - state_index - 1) * increment``, so the expected utility of each decision
+    state is linear in the weights. Inference runs once to get ``scores[d, c]``, the
+    expected increment score of criterion ``c`` under decision state ``d``; expected
+    utilities for any number of preference vectors are then a matrix product.
+
+    Parameters
+    ----------
+    model : pyagrum.InfluenceDiagram or NumpyDiagram
+        Influence diagram with one decision node
+    criteria : list of str, optional
+        Chance nodes the preferences refer to; the utility parents by default. They do
+        not need to be utility parents, e.g. when evaluating blended preferences.
+    evidence : dict
+        Evidence the expectations are conditioned on
+    increment : float
+        Increment per state, 100 as in ``utility_parameters_from_weights``
+
+    Attributes
+    ----------
+    decision_labels : list of str
+    criteria : list of str
+    scores : numpy.ndarray
+        ``(decision states, criteria)`` expected increment scores
+    """
+
+    def __init__(self, model, criteria=None, evidence={}, increment=100):
+        compiled = model if isinstance(model, NumpyDiagram) else NumpyDiagram(model)
+        if criteria is None:
+            criteria = list(compiled.utility[1])
+        missing = [name for name in criteria if name not in compiled.cpts]
+        if missing:
+            raise ValueError(f"Criteria {missing} are not chance nodes of the model")
+
+        self.decision_labels = list(compiled.decision_labels)
+        self.criteria = list(criteria)
+        self.scores = np.empty((len(self.decision_labels), len(self.criteria)))
+        for i, name in enumerate(self.criteria):
+            num_states = len(compiled.labels[name])
+            state_scores = (num_states - np.arange(num_states) - 1) * float(increment)
+            self.scores[:, i] = compiled.posterior(name, evidence) @ state_scores
+
+    def weight_matrix(self, weights):
+        """Normalised weight rows aligned with ``criteria``, see ``normalised_weights``."""
+        return normalised_weights(weights, self.criteria)
+
+    def expected_utilities(self, weights):
+        """``(vectors, decision states)`` expected utilities of the preference vectors."""
+        return self.weight_matrix(weights) @ self.scores.T
+
+    def evaluate(self, weights):
+        """
+        Expected utilities, MEU and optimal decision for each preference vector.
+
+        Returns
+        -------
+        tuple
+            - numpy.ndarray: ``(vectors, decision states)`` expected utilities
+            - numpy.ndarray: MEU per vector
+            - numpy.ndarray: index of the optimal decision state per vector
+        """
+        utilities = self.expected_utilities(weights)
+        best = np.argmax(utilities, axis=1)
+        return utilities, utilities[np.arange(len(best)), best], best
+
+    def decisions(self, indices):
+        """Decision labels of decision state indices."""
+        return np.array(self.decision_labels, dtype=object)[indices]
+
+
+def grid_weights(n_criteria, resolution=10):
+    """
+    Regular grid over the weight simplex.
+
+    Returns every weight vector whose entries are multiples of ``1 / resolution`` and
+    sum to one, as an ``(points, n_criteria)`` array.
+    """
+    points = []
+    for cuts in itertools.combinations(range(resolution + n_criteria - 1), n_criteria - 1):
+        bounds = (-1,) + cuts + (resolution + n_criteria - 1,)
+        points.append([bounds[i + 1] - bounds[i] - 1 for i in range(n_criteria)])
+    return np.array(points, dtype=float) / resolution
+
+
+def latin_hypercube_weights(n_criteria, n_samples, seed=None):
+    """Latin hypercube sample of unnormalised weights in the unit cube."""
+    rng = np.random.default_rng(seed)
+    strata = np.argsort(rng.random((n_criteria, n_samples)), axis=1).T
+    return (strata + rng.random((n_samples, n_criteria))) / n_samples
+
+
+def dirichlet_weights(n_criteria, n_samples, alpha=1.0, seed=None):
+    """Dirichlet sample of weight vectors, uniform over the simplex for ``alpha=1``."""
+    rng = np.random.default_rng(seed)
+    return rng.dirichlet(np.full(n_criteria, float(alpha)), size=n_samples)
+
+
+def preference_sweep(decomposition, weights=None, method="grid", n_samples=10000, resolution=10,
+                     seed=None, batch_size=100000):
+    """
+    Optimal decision and MEU over a sample of the preference space.
+
+    Parameters
+    ----------
+    decomposition : UtilityDecomposition
+        Expected criterion scores of the model
+    weights : array_like, optional
+        ``(samples, criteria)`` weights to evaluate; sampled with ``method`` otherwise
+    method : {"grid", "lhs", "dirichlet"}
+        ``grid_weights`` with ``resolution``, or ``latin_hypercube_weights`` /
+        ``dirichlet_weights`` with ``n_samples`` and ``seed``
+    batch_size : int
+        Number of weight vectors evaluated per matrix product
+
+    Returns
+    -------
+    dict
+        ``weights``, ``utilities`` (samples, decision states), ``meu``, ``decision``
+        (decision state index) and ``labels`` (decision labels)
+    """
+    n_criteria = len(decomposition.criteria)
+    if weights is None:
+        if method == "grid":
+            weights = grid_weights(n_criteria, resolution)
+        elif method == "lhs":
+            weights = latin_hypercube_weights(n_criteria, n_samples, seed)
+        elif method == "dirichlet":
+            weights = dirichlet_weights(n_criteria, n_samples, seed=seed)
+        else:
+            raise ValueError(f"Unknown sampling method '{method}'")
+    weights = np.atleast_2d(np.asarray(weights, dtype=float))
+
+    utilities = np.empty((len(weights), len(decomposition.decision_labels)))
+    meu = np.empty(len(weights))
+    decision = np.empty(len(weights), dtype=np.int64)
+    for start in range(0, len(weights), batch_size):
+        batch = slice(start, start + batch_size)
+        utilities[batch], meu[batch], decision[batch] = decomposition.evaluate(weights[batch])
+
+    return {
+        "weights": weights,
+        "utilities": utilities,
+        "meu": meu,
+        "decision": decision,
+        "labels": decomposition.decisions(decision),
+    }
+
+
+def decision_regions(sweep):
+    """Share of the swept preference vectors recommending each decision label."""
+    labels, counts = np.unique(sweep["labels"].astype(str), return_counts=True)
+    return dict(zip(labels.tolist(), (counts / counts.sum()).tolist()))
+
+
+def _blend_rows(decomposition, patient_prefs, clinician_prefs):
+    """Criterion weights of the clinician and of the blending direction, and their totals."""
+    names = set(patient_prefs) | set(clinician_prefs)
+    clinician = np.array([clinician_prefs.get(name, 0.0) for name in decomposition.criteria])
+    patient = np.array([patient_prefs.get(name, 0.0) for name in decomposition.criteria])
+    clinician_total = sum(clinician_prefs.get(name, 0.0) for name in names)
+    patient_total = sum(patient_prefs.get(name, 0.0) for name in names)
+    return clinician, patient - clinician, clinician_total, patient_total - clinician_total
+
+
+def alpha_sweep(decomposition, patient_prefs, clinician_prefs, alphas):
+    """
+    Decisions along the blending factor of ``preference_transfer2``.
+
+    The blended weights are ``alpha * patient + (1 - alpha) * clinician`` over the union of
+    both preference dicts, normalised as in ``preference_transfer2``.
+
+    Returns
+    -------
+    dict
+        ``alpha``, ``utilities`` (alphas, decision states), ``meu``, ``decision`` and ``labels``
+    """
+    alphas = np.atleast_1d(np.asarray(alphas, dtype=float))
+    base, direction, base_total, direction_total = _blend_rows(decomposition, patient_prefs, clinician_prefs)
+    weights = (base[None, :] + alphas[:, None] * direction[None, :]) / (base_total + alphas * direction_total)[:, None]
+    utilities = weights @ decomposition.scores.T
+    decision = np.argmax(utilities, axis=1)
+    return {
+        "alpha": alphas,
+        "utilities": utilities,
+        "meu": utilities[np.arange(len(alphas)), decision],
+        "decision": decision,
+        "labels": decomposition.decisions(decision),
+    }
+
+
+def alpha_switch_points(decomposition, patient_prefs, clinician_prefs, lower=0.0, upper=1.0):
+    """
+    Exact blending factors at which the shared decision switches.
+
+    With positive total weight the normalisation does not change the ranking, so each
+    decision's utility is proportional to a line in alpha and the switches are the
+    breakpoints of the upper envelope of those lines in ``[lower, upper]``.
+
+    Returns
+    -------
+    list of dict
+        ``{"alpha": float, "from": str, "to": str}`` in increasing alpha
+    """
+    base, direction, _, _ = _blend_rows(decomposition, patient_prefs, clinician_prefs)
+    intercepts = decomposition.scores @ base
+    slopes = decomposition.scores @ direction
+
+    candidates = {lower, upper}
+    for i, j in itertools.combinations(range(len(intercepts)), 2):
+        if slopes[i] != slopes[j]:
+            crossing = (intercepts[j] - intercepts[i]) / (slopes[i] - slopes[j])
+            if lower < crossing < upper:
+                candidates.add(float(crossing))
+    breakpoints = sorted(candidates)
+
+    switches = []
+    previous = None
+    for left, right in zip(breakpoints[:-1], breakpoints[1:]):
+        middle = (left + right) / 2
+        best = int(np.argmax(intercepts + middle * slopes))
+        if previous is not None and best != previous:
+            switches.append({
+                "alpha": left,
+                "from": decomposition.decision_labels[previous],
+                "to": decomposition.decision_labels[best],
+            })
+        previous = best
+    return switches
+
+
+def check_numpy_backend(model, evidences=None, atol=1e-8):
+    """
+    Compare ``NumpyDiagram`` against ``ShaferShenoyLIMIDInference`` on a model.
+
+    By default the empty evidence and every single (node, label) clamp of a chance node
+    are checked; an ``AssertionError`` is raised on the first mismatch.
+
+    Returns
+    -------
+    float
+        Largest absolute difference in the decision utilities
+    """
+    compiled = NumpyDiagram(model)
+    if evidences is None:
+        evidences = [{}] + [
+            {name: label} for name in compiled.cpts for label in compiled.labels[name]
+        ]
+    limid = ShaferShenoyLIMIDInference(model)
+    largest = 0.0
+    for evidence in evidences:
+        limid.setEvidence(evidence)
+        limid.makeInference()
+        expected = limid.posteriorUtility(compiled.decision_name).toarray()
+        actual = compiled.decision_utilities(evidence)
+        difference = float(np.max(np.abs(expected - actual)))
+        assert difference <= atol, f"NumPy backend differs by {difference} with evidence {evidence}"
+        largest = max(largest, difference)
+    return largest
+
+
+def _topological_order(compiled, names):
+    """``names`` ordered parents first."""
+    names = set(names)
+    order, seen = [], set()
+
+    def visit(name):
+        if name in seen:
+            return
+        seen.add(name)
+        for parent in compiled.parents[name]:
+            if parent in names:
+                visit(parent)
+        order.append(name)
+
+    for name in sorted(names):
+        visit(name)
+    return order
+
+
+@profiled
+def sample_decision_utilities(model, evidence={}, batch_size=1024, max_samples=262144, z=1.96, seed=0):
+    """
+    Expected utility of each decision state estimated by likelihood-weighted sampling.
+
+    The chance nodes that are ancestors of the utility node or of the evidence are
+    forward sampled in vectorized rounds per decision state, with the same random numbers
+    for every state; the first round draws ``batch_size`` and every round doubles it. Evidence nodes are drawn from their
+    CPT times the evidence likelihood and the draw is weighted by the normaliser. The
+    utility table of ``calculate_utility_values`` is then read per draw. Sampling stops
+    once the confidence interval of the difference between the best decision state and
+    every other one excludes 0, or after ``max_samples`` draws per state.
+
+    Parameters
+    ----------
+    model : pyagrum.InfluenceDiagram or NumpyDiagram
+    evidence : dict
+    batch_size : int
+        Draws per decision state in the first round
+    max_samples : int
+        Largest number of draws per decision state
+    z : float
+        Normal quantile of the confidence intervals, 1.96 for 95%
+    seed : int, optional
+        Seed of the draws; the default makes repeated calls reproducible
+
+    Returns
+    -------
+    dict
+        - ``utilities``: estimated expected utility per decision state
+        - ``half_width``: confidence half-width per decision state
+        - ``gap_half_width``: confidence half-width of the difference between the best
+          decision state and each state (0 for the best itself)
+        - ``samples``: draws per decision state
+        - ``separated``: whether the best decision state was separated from the others
+    """
+    compiled = model if isinstance(model, NumpyDiagram) else NumpyDiagram(model)
+    utility_array, utility_axes = compiled.utility
+    vectors = {name: compiled.evidence_vector(name, value) for name, value in evidence.items()}
+    order = _topological_order(compiled, compiled._relevant(list(utility_axes) + list(evidence)))
+    n_states = len(compiled.decision_labels)
+    rng = np.random.default_rng(seed)
+
+    # Weighted sums over the draws, as (decision, decision) matrices of products, so the
+    # covariance of the paired estimates follows from the delta method
+    sum_ww = np.zeros((n_states, n_states))
+    sum_wwu = np.zeros((n_states, n_states))
+    sum_wwuu = np.zeros((n_states, n_states))
+    sum_w = np.zeros(n_states)
+    sum_wu = np.zeros(n_states)
+    samples = 0
+    while True:
+        size = min(batch_size, max_samples - samples)
+        batch_size *= 2
+        draws = {compiled.decision_name: np.repeat(np.arange(n_states), size).reshape(n_states, size)}
+        weights = np.ones((n_states, size))
+        for name in order:
+            array, axes = compiled.cpts[name]
+            probabilities = array[tuple(draws[parent] for parent in axes[:-1])]
+            probabilities = np.broadcast_to(probabilities, (n_states, size, array.shape[-1]))
+            if name in vectors:
+                probabilities = probabilities * vectors[name]
+                totals = probabilities.sum(axis=-1)
+                weights *= totals
+            else:
+                totals = probabilities.sum(axis=-1)
+            uniform = rng.random(size) * totals
+            cumulative = np.cumsum(probabilities, axis=-1)
+            states = (cumulative < uniform[..., None]).sum(axis=-1)
+            draws[name] = np.minimum(states, array.shape[-1] - 1)
+        values = utility_array[tuple(draws[name] for name in utility_axes)]
+        values = np.broadcast_to(values, (n_states, size))
+        weighted = weights * values
+        sum_ww += weights @ weights.T
+        sum_wwu += weighted @ weights.T
+        sum_wwuu += weighted @ weighted.T
+        sum_w += weights.sum(axis=1)
+        sum_wu += weighted.sum(axis=1)
+        samples += size
+
+        possible = sum_w > 0
+        means = np.divide(sum_wu, sum_w, out=np.zeros(n_states), where=possible)
+        scale = np.where(possible, sum_w, np.inf)
+        covariance = (sum_wwuu - means[None, :] * sum_wwu - means[:, None] * sum_wwu.T
+                      + np.outer(means, means) * sum_ww) / np.outer(scale, scale)
+        variance = np.maximum(np.diag(covariance), 0.0)
+        best = int(np.argmax(means))
+        gap_variance = np.maximum(variance[best] + variance - 2 * covariance[best], 0.0)
+        half_width = z * np.sqrt(variance)
+        gap_half_width = z * np.sqrt(gap_variance)
+        gap_half_width[best] = 0.0
+        others = np.arange(n_states) != best
+        separated = bool(np.all((means[best] - means[others]) > gap_half_width[others]))
+        if separated or samples >= max_samples:
+            break
+
+    half_width = np.where(possible, half_width, np.inf)
+    return {
+        "utilities": means,
+        "half_width": half_width,
+        "gap_half_width": gap_half_width,
+        "samples": samples,
+        "separated": separated,
+    }
+
+
+class DecisionCache:
+    """
+    Bounded LRU cache of ``show_decision_utilities`` results.
+
+    Keys are ``(model_fingerprint(model), evidence)`` pairs; ``hits`` and ``misses``
+    count how many solves were skipped and performed.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def put(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        """Hit/miss counters and current size as a dict."""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "maxsize": self.maxsize}
+
+
+def utility_parameters_from_weights(prefs):
+    """Temporary function to be compatible with Zeliha's weights"""
+    num_parents = len(prefs)    
+    parents = list(prefs.keys())    
+    pref_values = np.array(list(prefs.values()))    
+    weights = pref_values / pref_values.sum() 
+    return np.vstack([parents, weights, np.repeat(100,num_parents)]).T
+
+
+def utility_arrays_from_weights(prefs, increment=100):
+    """
+    Typed counterpart of ``utility_parameters_from_weights``.
+
+    Returns
+    -------
+    tuple
+        - list of str: criteria names
+        - numpy.ndarray: normalised float weights
+        - numpy.ndarray: float increments
+    """
+    parents = list(prefs.keys())
+    pref_values = np.array(list(prefs.values()), dtype=float)
+    weights = pref_values / pref_values.sum()
+    return parents, weights, np.full(len(parents), float(increment))
+
+
+
+def voe(id):
+    """"
+    Compute value of evidence per state for each non-decision, non-utility node.
+    Uses Shafer–Shenoy LIMID inference to compare base MEU to MEU with each node clamped,
+    returning a DataFrame of {node, label, utility_delta} sorted by utility (desc).
+    """
+    return voe_frame(voe_analysis(id, max_workers=1))
+
+
+@profiled
+def voe_analysis(model, evidence={}, nodes=None, max_workers=None, chunksize=None):
+    """
+    Value of evidence and of perfect information for the chance nodes of a model.
+
+    Every (node, label) pair is clamped on top of ``evidence`` and solved. The pairs are
+    partitioned over a process pool whose workers each compile one
+    ``ShaferShenoyLIMIDInference`` for the model and only swap its evidence.
+
+    Parameters
+    ----------
+    model : pyagrum.InfluenceDiagram
+        Influence diagram to analyse
+    evidence : dict
+        Evidence the analysis is conditioned on; observed nodes are skipped
+    nodes : iterable of str, optional
+        Chance nodes to analyse, all of them by default
+    max_workers : int, optional
+        Size of the process pool; 1 evaluates in the calling process
+
+    Returns
+    -------
+    dict
+        - ``node``, ``label``: node and label of each clamped pair
+        - ``utility``: MEU difference to the base MEU per pair
+        - ``prior``: marginal probability of the label under the base evidence
+        - ``nodes``, ``evpi``: expected value of perfect information per node,
+          the per-label MEU differences weighted by the node's prior marginal
+        - ``base_meu``: MEU under ``evidence``
+    """
+    with _phase("engine_build"):
+        limid = ShaferShenoyLIMIDInference(model)
+    limid.setEvidence(evidence)
+    _count_solve(model)
+    with _phase("make_inference"):
+        limid.makeInference()
+    nodes, pairs, priors, base_utility = _voe_pairs(model, limid, evidence, nodes)
+    meus = _evaluate_clamped(model, evidence, pairs, max_workers, chunksize)
+    return _voe_result(nodes, pairs, priors, meus, base_utility)
+
+
+def _voe_pairs(model, limid, evidence, nodes):
+    """Analysed nodes, their (node, label) pairs with priors, and the base MEU of a solved engine."""
+    if nodes is None:
+        nodes = [name for name in model.names() if model.isChanceNode(name)]
+    nodes = [name for name in _ordered_variables(set(nodes)) if name not in evidence]
+    base_utility = limid.MEU()["mean"]
+
+    pairs, priors = [], []
+    for node_name in nodes:
+        labels = model.variableFromName(node_name).labels()
+        marginal = limid.posterior(node_name).toarray()
+        for label, prior in zip(labels, marginal):
+            pairs.append((node_name, label))
+            priors.append(prior)
+    return nodes, pairs, priors, base_utility
+
+
+def _voe_result(nodes, pairs, priors, meus, base_utility):
+    node_column = np.array([node for node, _ in pairs], dtype=object)
+    utility = meus - base_utility
+    prior = np.array(priors, dtype=float)
+    node_index = np.searchsorted(np.array(nodes, dtype=object), node_column)
+    # Impossible labels (zero prior) solve to NaN and do not contribute
+    weighted = np.where(prior > 0, prior * np.nan_to_num(utility), 0.0)
+    evpi = np.bincount(node_index, weights=weighted, minlength=len(nodes))
+
+    return {
+        "node": node_column,
+        "label": np.array([label for _, label in pairs], dtype=object),
+        "utility": utility,
+        "prior": prior,
+        "nodes": np.array(nodes, dtype=object),
+        "evpi": evpi,
+        "base_meu": base_utility,
+    }
+
+
+def voe_frame(result):
+    """DataFrame view of ``voe_analysis`` per-label results, sorted by utility (desc)."""
+    frame = pd.DataFrame({"node": result["node"], "label": result["label"], "utility": result["utility"]})
+    return frame.sort_values("utility", ascending=False)
+
+
+_VOE_WORKER = {}
+
+
+def _init_voe_worker(model, evidence):
+    # One compiled inference engine per worker, only its evidence changes between tasks
+    _VOE_WORKER["model"] = model
+    _VOE_WORKER["evidence"] = evidence
+    with _phase("engine_build"):
+        _VOE_WORKER["limid"] = ShaferShenoyLIMIDInference(model)
+
+
+def _voe_chunk(pairs):
+    return _clamped_meus(_VOE_WORKER["model"], _VOE_WORKER["limid"], _VOE_WORKER["evidence"], pairs)
+
+
+def _clamped_meus(model, limid, evidence, pairs):
+    """MEU with each (node, label) pair clamped on top of ``evidence``, on one engine."""
+    meus = np.empty(len(pairs))
+    for i, (node_name, label) in enumerate(pairs):
+        limid.setEvidence({**evidence, node_name: label})
+        _count_solve(model)
+        with _phase("make_inference"):
+            limid.makeInference()
+        meus[i] = limid.MEU()["mean"]
+    return meus
+
+
+def _evaluate_clamped(model, evidence, pairs, max_workers, chunksize):
+    """MEU of the model with each (node, label) pair clamped, in the order of ``pairs``."""
+    if not pairs:
+        return np.empty(0)
+    if max_workers == 1:
+        _init_voe_worker(model, evidence)
+        return _voe_chunk(pairs)
+
+    if chunksize is None:
+        chunksize = max(1, -(-len(pairs) // (max_workers or os.cpu_count() or 1)))
+    chunks = [pairs[i:i + chunksize] for i in range(0, len(pairs), chunksize)]
+    return np.concatenate(list(_ordered_map(_voe_chunk, chunks, max_workers, _init_voe_worker, (model, evidence))))
+
+
+def _cohort_rows(rows):
+    """List of dicts from a DataFrame or a list of dicts, without missing entries."""
+    if isinstance(rows, pd.DataFrame):
+        rows = rows.to_dict(orient="records")
+    cleaned = []
+    for row in rows:
+        clean = dict()
+        for name, value in row.items():
+            if value is None or (isinstance(value, float) and np.isnan(value)):
+                continue
+            # Integral floats come from DataFrame columns holding missing values
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            clean[name] = value
+        cleaned.append(clean)
+    return cleaned
+
+
+_COHORT_WORKER = {}
+
+
+def _init_cohort_worker(compiled, criteria):
+    _COHORT_WORKER["compiled"] = compiled
+    _COHORT_WORKER["criteria"] = criteria
+
+
+def _cohort_scores_chunk(evidences):
+    compiled = _COHORT_WORKER["compiled"]
+    criteria = _COHORT_WORKER["criteria"]
+    return [UtilityDecomposition(compiled, criteria, evidence).scores for evidence in evidences]
+
+
+@profiled
+def evaluate_cohort(evidence, preferences, model="patient", criteria=None, max_workers=1, chunksize=64):
+    """
+    Expected utilities and recommendations for a whole cohort in one call.
+
+    The model structure is compiled once to a ``NumpyDiagram``. Patients are grouped by
+    their evidence, the criterion scores of every distinct evidence are computed once
+    (see ``UtilityDecomposition``) and each patient's preferences are applied as a matrix
+    product, so the utility table is never rebuilt per patient.
+
+    Parameters
+    ----------
+    evidence : pandas.DataFrame or list of dict
+        One row of evidence per patient; missing values (NaN/None) are unobserved
+    preferences : pandas.DataFrame, list of dict or array_like
+        One row of unnormalised ``pu_parameters``-style weights per patient, normalised
+        like ``utility_parameters_from_weights``; arrays need one column per criterion
+    model : {"patient", "clinician"}, pyagrum.InfluenceDiagram or NumpyDiagram
+        Model whose structure and CPTs are used
+    criteria : list of str, optional
+        Utility criteria, the utility parents of the model by default
+    max_workers : int
+        Worker processes computing the scores of distinct evidences; 1 stays in process
+
+    Returns
+    -------
+    dict
+        ``utilities`` (patients, decision states), ``meu``, ``decision`` (decision state
+        index), ``labels`` (recommended treatment) and ``decision_labels``
+    """
+    if isinstance(model, str):
+        model = models.model_copy(model)
+    compiled = model if isinstance(model, NumpyDiagram) else NumpyDiagram(model)
+    if criteria is None:
+        criteria = list(compiled.utility[1])
+
+    evidences = _cohort_rows(evidence)
+    if not isinstance(preferences, (pd.DataFrame, list, tuple)) or (
+            isinstance(preferences, (list, tuple)) and preferences and not isinstance(preferences[0], dict)):
+        preferences = np.asarray(preferences, dtype=float)
+    else:
+        preferences = _cohort_rows(preferences)
+    if len(preferences) != len(evidences):
+        raise ValueError(f"Got {len(evidences)} evidence rows and {len(preferences)} preference rows")
+
+    keys = [_evidence_key(row) for row in evidences]
+    distinct = dict()
+    for key, row in zip(keys, evidences):
+        distinct.setdefault(key, row)
+    distinct_keys = list(distinct)
+    chunks = [[distinct[key] for key in distinct_keys[i:i + chunksize]]
+              for i in range(0, len(distinct_keys), chunksize)]
+    outputs = _ordered_map(_cohort_scores_chunk, chunks, max_workers, _init_cohort_worker, (compiled, criteria))
+    scores = np.stack([score for chunk in outputs for score in chunk])
+
+    weights = normalised_weights(preferences, criteria)
+    index = {key: i for i, key in enumerate(distinct_keys)}
+    group = np.array([index[key] for key in keys], dtype=np.int64)
+    utilities = np.einsum("pc,pdc->pd", weights, scores[group])
+    decision = np.argmax(utilities, axis=1)
+    decision_labels = list(compiled.decision_labels)
+    return {
+        "utilities": utilities,
+        "meu": utilities[np.arange(len(decision)), decision],
+        "decision": decision,
+        "labels": np.array(decision_labels, dtype=object)[decision],
+        "decision_labels": decision_labels,
+    }
+
+
+# Name of the leading axis of sampled CPTs
+_SAMPLE_AXIS = "__sample__"
+
+
+def _sample_letters(compiled):
+    """einsum letters of a compiled diagram plus one for the sample (or batch) axis."""
+    if len(compiled._letters) == len(_EINSUM_LETTERS):
+        raise ValueError("No einsum letter left for the sample axis")
+    return {**compiled._letters, _SAMPLE_AXIS: _EINSUM_LETTERS[len(compiled._letters)]}
+
+
+def dirichlet_cpts(compiled, nodes, n_samples, concentration=100.0, rng=None):
+    """
+    CPTs of ``nodes`` sampled from Dirichlet distributions centred on the compiled ones.
+
+    Every conditional distribution ``p`` of a node is replaced by draws from
+    ``Dirichlet(concentration * p)``; larger concentrations give draws closer to ``p``.
+    States with probability 0 stay impossible.
+
+    Parameters
+    ----------
+    compiled : NumpyDiagram
+    nodes : list of str
+        Chance nodes whose CPTs are sampled
+    n_samples : int
+    concentration : float or dict
+        One concentration, or one per node (nodes missing from the dict use 100)
+    rng : numpy.random.Generator, optional
+
+    Returns
+    -------
+    dict
+        Node name mapped to ``(array, axis_names)`` with a leading sample axis, usable as
+        CPTs of ``NumpyDiagram``
+    """
+    rng = np.random.default_rng(rng)
+    sampled = dict()
+    for name in nodes:
+        array, axes = compiled.cpts[name]
+        scale = concentration.get(name, 100.0) if isinstance(concentration, dict) else concentration
+        # The node's own axis is the last one, so each row over it is a distribution
+        alpha = scale * array
+        possible = alpha > 0
+        draws = rng.standard_gamma(np.where(possible, alpha, 1.0), size=(n_samples,) + array.shape)
+        draws = np.where(possible, draws, 0.0)
+        totals = draws.sum(axis=-1, keepdims=True)
+        draws = np.divide(draws, totals, out=np.broadcast_to(array, draws.shape).copy(), where=totals > 0)
+        sampled[name] = (draws, (_SAMPLE_AXIS,) + axes)
+    return sampled
+
+
+def sampled_decision_utilities(compiled, sampled, n_samples, evidence={}):
+    """
+    Expected utility of each decision state for every sampled set of CPTs.
+
+    All samples are solved by one ``einsum`` contraction with a sample axis, as in
+    ``NumpyDiagram.decision_utilities``. ``sampled`` maps node names to
+    ``(array, axis_names)`` with a leading sample axis (see ``dirichlet_cpts``) or without
+    one for CPTs shared by all samples; the compiled CPTs are used for the other nodes.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``(n_samples, decision states)``
+    """
+    letters = _sample_letters(compiled)
+    operands = compiled._factors(evidence, compiled.utility[1], {**compiled.cpts, **sampled})
+    operands.append((np.ones(n_samples), (_SAMPLE_AXIS,)))
+    output = (_SAMPLE_AXIS, compiled.decision_name)
+    numerator = _contract_named(operands + [compiled.utility], output, letters, _SAMPLE_AXIS)
+    denominator = _contract_named(operands, output, letters, _SAMPLE_AXIS)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def _stacked_likelihoods(compiled, evidences, observable=None):
+    """
+    Likelihood operands of ``evidences`` stacked along the sample axis.
+
+    Every node observed in one of the evidences, and every ``observable`` node, gets an
+    ``(evidences, states)`` operand; evidences not observing it get a vector of ones,
+    which leaves their results unchanged.
+    """
+    likelihoods = dict()
+    for name in sorted(set().union(*evidences, observable or ())):
+        vectors = [compiled.evidence_vector(name, evidence[name]) if name in evidence else None
+                   for evidence in evidences]
+        ones = np.ones(len(compiled.labels[name]))
+        stacked = np.stack([ones if vector is None else vector for vector in vectors])
+        likelihoods[name] = (stacked, (_SAMPLE_AXIS, name))
+    return likelihoods
+
+
+def batched_decision_utilities(compiled, evidences, observable=None):
+    """
+    Expected utility of each decision state for a batch of evidences.
+
+    The likelihood vectors of the evidences are stacked along a batch axis and all of them
+    are solved by one contraction; each row matches ``NumpyDiagram.decision_utilities``
+    of its evidence. Listing ``observable`` nodes gives them likelihood operands even when
+    unobserved, so batches with different evidence share one cached contraction order.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``(evidences, decision states)``
+    """
+    if not evidences:
+        return np.empty((0, len(compiled.decision_labels)))
+    letters = _sample_letters(compiled)
+    likelihoods = _stacked_likelihoods(compiled, evidences, observable)
+    operands = compiled._factors(likelihoods, compiled.utility[1], likelihoods=likelihoods)
+    operands.append((np.ones(len(evidences)), (_SAMPLE_AXIS,)))
+    output = (_SAMPLE_AXIS, compiled.decision_name)
+    numerator = _contract_named(operands + [compiled.utility], output, letters, _SAMPLE_AXIS)
+    denominator = _contract_named(operands, output, letters, _SAMPLE_AXIS)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def batched_voe(compiled, evidences, nodes=None, observable=None):
+    """
+    ``voe_analysis`` results for a batch of evidences on a ``NumpyDiagram``.
+
+    Instead of one solve per clamped (node, label) pair, the expected utilities of every
+    decision state and label of a node come from one contraction per node, batched over
+    the evidences. The decision has no parents, so the prior of each label is its
+    posterior under the optimal decision. ``observable`` is passed on as in
+    ``batched_decision_utilities``.
+
+    Returns
+    -------
+    list of dict
+        One ``voe_analysis`` result per evidence
+    """
+    if not evidences:
+        return []
+    letters = _sample_letters(compiled)
+    batch = len(evidences)
+    likelihoods = _stacked_likelihoods(compiled, evidences, observable)
+    base = batched_decision_utilities(compiled, evidences, observable)
+    best = np.argmax(base, axis=1)
+    if nodes is None:
+        nodes = list(compiled.cpts)
+    nodes = _ordered_variables(set(nodes))
+
+    meus, priors = dict(), dict()
+    for name in nodes:
+        if all(name in evidence for evidence in evidences):
+            continue
+        operands = compiled._factors(likelihoods, list(compiled.utility[1]) + [name], likelihoods=likelihoods)
+        operands.append((np.ones(batch), (_SAMPLE_AXIS,)))
+        output = (_SAMPLE_AXIS, compiled.decision_name, name)
+        numerator = _contract_named(operands + [compiled.utility], output, letters, _SAMPLE_AXIS)
+        denominator = _contract_named(operands, output, letters, _SAMPLE_AXIS)
+        utilities = np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+        meus[name] = utilities.max(axis=1)
+        chosen = denominator[np.arange(batch), best]
+        totals = chosen.sum(axis=1, keepdims=True)
+        priors[name] = np.divide(chosen, totals, out=np.zeros_like(chosen), where=totals > 0)
+
+    results = []
+    for row, evidence in enumerate(evidences):
+        analysed = [name for name in nodes if name not in evidence]
+        pairs = [(name, label) for name in analysed for label in compiled.labels[name]]
+        row_meus = np.concatenate([meus[name][row] for name in analysed]) if analysed else np.empty(0)
+        row_priors = np.concatenate([priors[name][row] for name in analysed]) if analysed else np.empty(0)
+        results.append(_voe_result(analysed, pairs, row_priors, row_meus, float(base[row, best[row]])))
+    return results
+
+
+_PSA_WORKER = {}
+
+
+def _init_psa_worker(compiled, nodes, concentration, evidence):
+    _PSA_WORKER["compiled"] = compiled
+    _PSA_WORKER["nodes"] = nodes
+    _PSA_WORKER["concentration"] = concentration
+    _PSA_WORKER["evidence"] = evidence
+
+
+def _psa_chunk(task):
+    # Tasks carry a seed and sizes only; the CPTs are sampled and solved in the worker
+    seed, size, group, n_inner = task
+    compiled = _PSA_WORKER["compiled"]
+    nodes = _PSA_WORKER["nodes"]
+    concentration = _PSA_WORKER["concentration"]
+    evidence = _PSA_WORKER["evidence"]
+    rng = np.random.default_rng(seed)
+    if group is None:
+        sampled = dirichlet_cpts(compiled, nodes, size, concentration, rng)
+        return sampled_decision_utilities(compiled, sampled, size, evidence)
+
+    # Expected utilities conditional on each outer draw of the group's CPTs
+    others = [name for name in nodes if name not in group]
+    means = np.empty((size, len(compiled.decision_labels)))
+    for i in range(size):
+        fixed = dirichlet_cpts(compiled, group, 1, concentration, rng)
+        fixed = {name: (array[0], axes[1:]) for name, (array, axes) in fixed.items()}
+        sampled = dirichlet_cpts(compiled, others, n_inner, concentration, rng)
+        means[i] = sampled_decision_utilities(compiled, {**sampled, **fixed}, n_inner, evidence).mean(axis=0)
+    return means
+
+
+def _weighted_diagram(model, weights=None):
+    """
+    ``NumpyDiagram`` of ``model`` with its utility table set.
+
+    A model name is built with ``build_cid``/``build_pid`` from ``weights``. Models
+    whose utility table is all zeros, like the ``models.model_copy`` templates, are
+    rejected because every treatment would have expected utility 0.
+    """
+    if isinstance(model, str):
+        builders = {"clinician": build_cid, "patient": build_pid}
+        if model not in builders:
+            raise ValueError(f"Unknown model '{model}', expected one of {sorted(builders)}")
+        if weights is None:
+            raise ValueError(f"Preference weights are required to build the '{model}' model")
+        model = builders[model](weights)
+    elif weights is not None:
+        raise ValueError("Weights apply to a model name; a diagram already has its utility table")
+    compiled = model if isinstance(model, NumpyDiagram) else NumpyDiagram(model)
+    if not np.any(compiled.utility[0]):
+        raise ValueError(f"The utility table '{compiled.utility_name}' is all zeros; "
+                         "build the model with build_cid/build_pid or pass weights")
+    return compiled
+
+
+@profiled
+def probabilistic_sensitivity(model, weights=None, n_samples=1000, concentration=100.0, nodes=None, groups=None,
+                              evidence={}, n_outer=100, n_inner=100, max_workers=1, batch_size=250, seed=None):
+    """
+    Probabilistic sensitivity analysis of the recommendation to the CPTs.
+
+    CPTs are sampled from Dirichlet distributions centred on the current ones (see
+    ``dirichlet_cpts``) and every sample is solved for the expected utility of each
+    treatment. Samples are solved in batches by ``sampled_decision_utilities`` on the
+    compiled ``NumpyDiagram``, so no model is rebuilt per sample; with several workers
+    only seeds are sent and the utility arrays come back.
+
+    The expected value of perfect information is ``E[max_d U(d)] - max_d E[U(d)]`` over
+    the samples. The EVPPI of a group of CPTs is estimated by nested Monte Carlo:
+    ``n_outer`` draws of the group, each with the expected utilities averaged over
+    ``n_inner`` draws of the other CPTs. Small ``n_inner`` biases the EVPPI upwards.
+
+    Parameters
+    ----------
+    model : {"patient", "clinician"}, pyagrum.InfluenceDiagram or NumpyDiagram
+        Model name, or a diagram with its utility table set (e.g. from ``build_cid``)
+    weights : dict, optional
+        Preference weights of a model name, as passed to ``build_cid``/``build_pid``
+    n_samples : int
+        Samples of all CPTs for the optimality probabilities and the EVPI
+    concentration : float or dict
+        Dirichlet concentration, one or per node
+    nodes : list of str, optional
+        Sampled chance nodes, the ancestors of the utility node and of the evidence by
+        default
+    groups : dict, optional
+        Group name mapped to the nodes whose EVPPI is computed jointly, one group per
+        sampled node by default; ``{}`` skips the EVPPI
+    evidence : dict
+        Evidence the expected utilities are conditioned on
+    n_outer, n_inner : int
+        Outer and inner sample sizes of the EVPPI
+    max_workers : int
+        Worker processes; 1 stays in process
+    batch_size : int
+        Samples solved per contraction
+    seed : int, optional
+
+    Returns
+    -------
+    dict
+        ``decision_labels``, ``utilities`` (samples, decision states), ``expected_utilities``
+        (Series), ``p_optimal`` (DataFrame of count, p and Wilson interval per treatment),
+        ``evpi`` and ``evppi`` (Series per group, largest first)
+    """
+    compiled = _weighted_diagram(model, weights)
+    if nodes is None:
+        nodes = compiled._relevant(list(compiled.utility[1]) + list(evidence))
+    nodes = list(nodes)
+    unknown = set(nodes).difference(compiled.cpts)
+    if unknown:
+        raise ValueError(f"Not chance nodes of the model: {sorted(unknown)}")
+    if groups is None:
+        groups = {name: [name] for name in nodes}
+    for name, members in groups.items():
+        if not set(members) <= set(nodes):
+            raise ValueError(f"Group '{name}' has nodes that are not sampled: {sorted(set(members) - set(nodes))}")
+
+    seeds = np.random.SeedSequence(seed).spawn(1 + len(groups))
+    batches = [min(batch_size, n_samples - start) for start in range(0, n_samples, batch_size)]
+    tasks = [(child, size, None, 0) for child, size in zip(seeds[0].spawn(len(batches)), batches)]
+    # Nested EVPPI tasks hold about batch_size solves each
+    outer_size = max(1, batch_size // max(1, n_inner))
+    group_tasks = []
+    for group_seed, (name, members) in zip(seeds[1:], groups.items()):
+        sizes = [min(outer_size, n_outer - start) for start in range(0, n_outer, outer_size)]
+        for child, size in zip(group_seed.spawn(len(sizes)), sizes):
+            group_tasks.append((name, (child, size, tuple(members), n_inner)))
+    tasks.extend(task for _, task in group_tasks)
+
+    outputs = list(_ordered_map(_psa_chunk, tasks, max_workers, _init_psa_worker,
+                                (compiled, nodes, concentration, evidence)))
+    utilities = np.concatenate(outputs[:len(batches)])
+    conditional = dict()
+    for (name, _), output in zip(group_tasks, outputs[len(batches):]):
+        conditional.setdefault(name, []).append(output)
+
+    decision_labels = list(compiled.decision_labels)
+    expected = utilities.mean(axis=0)
+    counts = np.bincount(np.argmax(utilities, axis=1), minlength=len(decision_labels))
+    evppi = dict()
+    for name, parts in conditional.items():
+        means = np.concatenate(parts)
+        evppi[name] = max(0.0, float(means.max(axis=1).mean() - means.mean(axis=0).max()))
+    return {
+        "decision_labels": decision_labels,
+        "utilities": utilities,
+        "expected_utilities": pd.Series(expected, index=decision_labels),
+        "p_optimal": _proportion_frame(counts, n_samples, decision_labels),
+        "evpi": float(utilities.max(axis=1).mean() - expected.max()),
+        "evppi": pd.Series(evppi, dtype=float).sort_values(ascending=False),
+    }
+
+
+# Pre-treatment findings of the clinician model that can be observed before deciding
+FINDINGS = ["smoking", "eye disease", "goiter", "hyperthyroidism", "Pre_TSH_Level"]
+
+
+class PolicyTable:
+    """
+    Optimal decision and expected utilities for every configuration of a few findings.
+
+    Each variable is one digit of a mixed-radix code: 0 when unobserved, ``k + 1`` for its
+    ``k``-th label, with the first variable most significant. Recommendations are then an
+    array index instead of a solve. Configurations with zero probability have utilities 0,
+    as in ``NumpyDiagram.decision_utilities``. Built by ``compile_policy_table``.
+
+    Attributes
+    ----------
+    variables : list of str
+    labels : dict
+        Labels of each variable
+    decision_labels : list of str
+    radices : numpy.ndarray
+        Number of labels plus one per variable
+    utilities : numpy.ndarray
+        ``(codes, decision states)`` expected utilities
+    decision : numpy.ndarray
+        Optimal decision state index per code
+    """
+
+    def __init__(self, variables, labels, decision_labels, utilities):
+        self.variables = list(variables)
+        self.labels = {name: list(labels[name]) for name in self.variables}
+        self.decision_labels = list(decision_labels)
+        self.radices = np.array([len(self.labels[name]) + 1 for name in self.variables], dtype=np.int64)
+        self.utilities = np.asarray(utilities, dtype=float)
+        if self.utilities.shape != (int(np.prod(self.radices)), len(self.decision_labels)):
+            raise ValueError(f"Expected {int(np.prod(self.radices))} utility rows of {len(self.decision_labels)} "
+                             f"decision states, got {self.utilities.shape}")
+        self.decision = np.argmax(self.utilities, axis=1)
+        self._digits = [{**{label: k + 1 for k, label in enumerate(self.labels[name])},
+                         **{k: k + 1 for k in range(len(self.labels[name]))}} for name in self.variables]
+
+    def __len__(self):
+        return len(self.utilities)
+
+    def code(self, evidence):
+        """Code of an evidence dict; absent or None variables are unobserved."""
+        unknown = set(evidence).difference(self.variables)
+        if unknown:
+            raise ValueError(f"Evidence on {sorted(unknown)}, which the table does not cover")
+        code = 0
+        for name, radix, digits in zip(self.variables, self.radices, self._digits):
+            value = evidence.get(name)
+            if value is not None and value not in digits:
+                raise ValueError(f"Label '{value}' is unknown in '{name}' {self.labels[name]}")
+            code = code * radix + (0 if value is None else digits[value])
+        return code
+
+    def codes(self, evidence):
+        """Codes of a DataFrame (missing values are unobserved) or a list of evidence dicts."""
+        if not isinstance(evidence, pd.DataFrame):
+            return np.array([self.code(row) for row in _cohort_rows(evidence)], dtype=np.int64)
+        unknown = set(evidence.columns).difference(self.variables)
+        if unknown:
+            raise ValueError(f"Evidence on {sorted(unknown)}, which the table does not cover")
+        codes = np.zeros(len(evidence), dtype=np.int64)
+        for name, radix, digits in zip(self.variables, self.radices, self._digits):
+            codes *= radix
+            if name not in evidence:
+                continue
+            column = evidence[name]
+            mapped = column.map(digits)
+            invalid = column.notna() & mapped.isna()
+            if invalid.any():
+                raise ValueError(f"Labels {sorted(map(str, column[invalid].unique()))} are unknown in '{name}'")
+            codes += mapped.fillna(0).to_numpy(dtype=np.int64)
+        return codes
+
+    def evidence(self, code):
+        """Evidence dict of a code."""
+        digits = np.unravel_index(code, self.radices)
+        return {name: self.labels[name][digit - 1] for name, digit in zip(self.variables, digits) if digit > 0}
+
+    def lookup(self, evidence={}):
+        """``show_decision_utilities`` output for ``evidence``, read from the table."""
+        code = self.code(evidence)
+        utilities = self.utilities[code]
+        best = self.decision[code]
+        return dict(zip(self.decision_labels, utilities.tolist())), utilities[best], self.decision_labels[best]
+
+    def recommend(self, evidence):
+        """Recommended treatment label per row of a DataFrame or list of evidence dicts."""
+        return np.array(self.decision_labels, dtype=object)[self.decision[self.codes(evidence)]]
+
+    def to_frame(self):
+        """One row per code with the evidence, the utilities and the recommendation."""
+        digits = np.unravel_index(np.arange(len(self)), self.radices)
+        columns = {name: pd.Categorical.from_codes(digit - 1, self.labels[name])
+                   for name, digit in zip(self.variables, digits)}
+        frame = pd.DataFrame(columns)
+        for j, label in enumerate(self.decision_labels):
+            frame[label] = self.utilities[:, j]
+        frame["decision"] = np.array(self.decision_labels, dtype=object)[self.decision]
+        return frame
+
+    def save(self, path):
+        """Write the table to an ``.npz`` file."""
+        meta = {"variables": self.variables, "labels": self.labels, "decision_labels": self.decision_labels}
+        np.savez(path, utilities=self.utilities, meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path):
+        """Read a table written by ``save``."""
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            return cls(meta["variables"], meta["labels"], meta["decision_labels"], data["utilities"])
+
+
+_POLICY_WORKER = {}
+
+
+def _init_policy_worker(compiled, variables, radices):
+    _POLICY_WORKER["compiled"] = compiled
+    _POLICY_WORKER["variables"] = variables
+    _POLICY_WORKER["radices"] = radices
+
+
+def _policy_chunk(bounds):
+    # Only the code range travels to the worker, which decodes its evidences
+    compiled = _POLICY_WORKER["compiled"]
+    variables = _POLICY_WORKER["variables"]
+    digits = np.unravel_index(np.arange(*bounds), _POLICY_WORKER["radices"])
+    evidences = [{name: compiled.labels[name][digit - 1] for name, digit in zip(variables, row) if digit > 0}
+                 for row in zip(*(digit.tolist() for digit in digits))]
+    return batched_decision_utilities(compiled, evidences, variables)
+
+
+@profiled
+def compile_policy_table(model="clinician", weights=None, variables=None, max_workers=1, chunksize=4096):
+    """
+    Solve every evidence configuration of ``variables`` into a ``PolicyTable``.
+
+    The configurations, each variable unobserved or at one of its labels, are solved in
+    chunks by ``batched_decision_utilities``; the preferences are those of the model's
+    utility table, or ``weights`` for a model name.
+
+    Parameters
+    ----------
+    model : {"clinician", "patient"}, pyagrum.InfluenceDiagram or NumpyDiagram
+        Model name, or a diagram with its utility table set (e.g. from ``build_cid``)
+    weights : dict, optional
+        Preference weights of a model name, as passed to ``build_cid``/``build_pid``
+    variables : list of str, optional
+        Observable chance nodes, the ``FINDINGS`` of the model by default
+    max_workers : int
+        Worker processes; 1 stays in process
+    chunksize : int
+        Configurations solved per contraction
+
+    Returns
+    -------
+    PolicyTable
+    """
+    compiled = _weighted_diagram(model, weights)
+    if variables is None:
+        variables = [name for name in FINDINGS if name in compiled.cpts]
+    variables = list(variables)
+    unknown = set(variables).difference(compiled.cpts)
+    if unknown:
+        raise ValueError(f"Not chance nodes of the model: {sorted(unknown)}")
+
+    radices = tuple(len(compiled.labels[name]) + 1 for name in variables)
+    size = int(np.prod(radices))
+    chunks = [(start, min(start + chunksize, size)) for start in range(0, size, chunksize)]
+    outputs = _ordered_map(_policy_chunk, chunks, max_workers, _init_policy_worker, (compiled, variables, radices))
+    return PolicyTable(variables, compiled.labels, compiled.decision_labels, np.concatenate(list(outputs)))
+
+
+@profiled
+def build_cid(weights_dict):
+    """Clinician influence diagram with its utility built from ``weights_dict``."""
+    cid = models.model_copy("clinician")
+    calculate_utility_values(cid, "DoctorU", utility_arrays_from_weights(weights_dict))
+    return cid
+
+
+@profiled
+def build_pid(weights_dict):
+    """Patient influence diagram with its utility built from ``weights_dict``."""
+    pid = models.model_copy("patient")
+    calculate_utility_values(pid, "PatientU", utility_arrays_from_weights(weights_dict))
+    return pid
+
+
+# Transfer settings of the SDM analysis: which base model is the origin of the
+# transferred variables, and whether chance nodes are transferred with the preferences.
+TRANSFER_SETTINGS = {
+    "informed_patient": {"origin": "clinician", "target": "patient", "chance_transfer": True},
+    "clinician_agent": {"origin": "patient", "target": "clinician", "chance_transfer": False},
+}
+
+
+@profiled
+def transfer_subset(variables, origin_model, target_model, origin_utility_pars, target_utility_pars,
+                    chance_transfer=True, stats=None, cache=None, backend="limid", plans=None):
+    """
+    Transfer a set of variables from the origin to a copy of the target model and solve it.
+
+    With ``chance_transfer`` the chance nodes are transferred first and the preferences
+    only for variables that did not exist in the target (informed patient setting);
+    otherwise only the preferences are transferred (clinician as agent setting).
+    Variables that are not utility parents in the origin model carry no preference
+    and are skipped for the preference transfer.
+    If a ``stats`` dict is given, the clones and variable transfers are counted in it;
+    a ``DecisionCache`` skips the solve of diagrams that were already evaluated.
+    ``backend`` is passed on to ``show_decision_utilities``. A ``plans`` dict replays the
+    chance node transfers from ``transfer_plan`` plans shared by the calls on the same,
+    unchanged models.
+
+    Returns
+    -------
+    tuple
+        - float: Maximum expected utility of the transferred target model
+        - str: Optimal decision state label
+        - float: With the ``"sampling"`` backend, confidence half-width of the MEU
+        - bool: With the ``"sampling"`` backend, whether the optimal decision state was
+          separated from the others
+    """
+    bounds = dict()
+    _, meu, meud = _solve_transfer(variables, origin_model, target_model, origin_utility_pars, target_utility_pars,
+                                   chance_transfer, stats, cache, backend, bounds, plans)
+    return (meu, meud) + _sampling_bounds(backend, bounds, meud)
+
+
+def _sampling_bounds(backend, bounds, meud):
+    """Half-width of the MEU and separation flag appended to sampled sweep results."""
+    if backend != "sampling":
+        return ()
+    return bounds["half_width"][meud], bounds["separated"]
+
+
+def _solve_transfer(variables, origin_model, target_model, origin_utility_pars, target_utility_pars,
+                    chance_transfer=True, stats=None, cache=None, backend="limid", bounds=None, plans=None):
+    """``transfer_subset`` returning the full ``show_decision_utilities`` output."""
+    with _phase("clone"):
+        target_temp = gum.InfluenceDiagram(target_model)
+    target_temp = _apply_transfers(variables, origin_model, target_temp, target_model,
+                                   origin_utility_pars, target_utility_pars.copy(), chance_transfer, plans)[0]
+    if stats is not None:
+        stats["clones"] = stats.get("clones", 0) + 1
+        stats["transfers"] = stats.get("transfers", 0) + len(variables)
+    state_utilities, meu, meud = show_decision_utilities(target_temp, cache=cache, backend=backend, bounds=bounds)
+    return state_utilities, float(meu), meud
+
+
+@profiled
+def transfer_lattice(analysis_variables, sizes, origin_model, target_model, origin_utility_pars, target_utility_pars,
+                     chance_transfer=True, roots=None, stats=None, cache=None, backend="limid", plans=None):
+    """
+    Depth-first walk over the subset lattice of ``analysis_variables``.
+
+    Subset ``(a, b, c)`` is obtained by cloning the already transferred model of
+    ``(a, b)`` and transferring only ``c``, so every visited subset costs one clone and
+    one variable transfer instead of ``k`` transfers on a fresh copy. Transfers are
+    applied as in ``transfer_subset``. At most ``max(sizes)`` models are alive at once.
+
+    Parameters
+    ----------
+    roots : iterable of int, optional
+        Restrict the walk to the subtrees of these first-variable indices (used to
+        split the lattice across workers)
+    stats : dict, optional
+        Receives the number of clones and variable transfers performed
+    cache : DecisionCache, optional
+        Memoizes the solves of identical transferred diagrams
+    backend : {"limid", "numpy", "sampling"}
+        Solver used by ``show_decision_utilities``
+    plans : dict, optional
+        ``transfer_plan`` plans of the two models; the walk compiles its own if omitted
+
+    Returns
+    -------
+    dict
+        ``{size: {subset: [meu, decision]}}`` with subsets in lexicographic order; the
+        ``"sampling"`` backend appends the bounds of ``transfer_subset``
+    """
+    variables = _ordered_variables(analysis_variables)
+    sizes = set(sizes)
+    max_size = max(sizes)
+    results = {k: dict() for k in sorted(sizes)}
+    if stats is None:
+        stats = dict()
+    stats.setdefault("clones", 0)
+    stats.setdefault("transfers", 0)
+    if plans is None:
+        plans = dict()
+
+    def visit(subset, indices, model, target_pars):
+        for i in indices:
+            var = variables[i]
+            with _phase("clone"):
+                child = gum.InfluenceDiagram(model)
+            child, child_pars = _apply_transfers((var,), origin_model, child, target_model,
+                                                 origin_utility_pars, target_pars.copy(), chance_transfer, plans)
+            stats["clones"] += 1
+            stats["transfers"] += 1
+            child_subset = subset + (var,)
+            if len(child_subset) in sizes:
+                bounds = dict()
+                _, meu, meud = show_decision_utilities(child, cache=cache, backend=backend, bounds=bounds)
+                results[len(child_subset)][child_subset] = [float(meu), meud, *_sampling_bounds(backend, bounds, meud)]
+            if len(child_subset) < max_size:
+                visit(child_subset, range(i + 1, len(variables)), child, child_pars)
+
+    root_indices = range(len(variables)) if roots is None else sorted(roots)
+    visit((), root_indices, target_model, target_utility_pars)
+    return results
+
+
+def _apply_transfers(variables, origin_model, target_temp, target_model, origin_utility_pars, target_pars, chance_transfer,
+                     plans=None):
+    """Apply the transfers of ``variables`` in place on ``target_temp``, from ``plans`` if given."""
+    origin_utility_name = get_utility_nodes(origin_model)[0]
+    if chance_transfer and plans is not None:
+        transfer_plan(variables, origin_model, target_model, plans).apply(target_temp)
+    elif chance_transfer:
+        for var in variables:
+            chance_node_transfer(var, origin_model, target_temp)
+    for var in variables:
+        if chance_transfer and target_model.exists(var):
+            continue
+        if not origin_model.existsArc(var, origin_utility_name):
+            continue
+        target_pars = preference_transfer(var, origin_model, target_temp, origin_utility_pars, target_pars)
+    return target_temp, target_pars
+
+
+def _transfer_models(setting, cu_parameters, pu_parameters):
+    """Origin/target models and preferences of a transfer setting."""
+    config = TRANSFER_SETTINGS[setting]
+    base = {
+        "clinician": (build_cid(cu_parameters), cu_parameters),
+        "patient": (build_pid(pu_parameters), pu_parameters),
+    }
+    origin_model, origin_pars = base[config["origin"]]
+    target_model, target_pars = base[config["target"]]
+    return origin_model, target_model, origin_pars, target_pars, config["chance_transfer"]
+
+
+_TRANSFER_WORKER = {}
+
+
+def _init_transfer_worker(setting, cu_parameters, pu_parameters, cache_size=0, backend="limid"):
+    # Base models are built once per worker process and reused for all its chunks
+    _TRANSFER_WORKER["models"] = _transfer_models(setting, cu_parameters, pu_parameters)
+    # The worker's models are never edited, so their transfer plans are shared by all chunks
+    _TRANSFER_WORKER["plans"] = dict()
+    _TRANSFER_WORKER["cache"] = DecisionCache(cache_size) if cache_size else None
+    _TRANSFER_WORKER["backend"] = backend
+
+
+def _transfer_chunk(subsets):
+    origin_model, target_model, origin_pars, target_pars, chance_transfer = _TRANSFER_WORKER["models"]
+    cache = _TRANSFER_WORKER["cache"]
+    backend = _TRANSFER_WORKER["backend"]
+    return [
+        transfer_subset(subset, origin_model, target_model, origin_pars, target_pars, chance_transfer,
+                        cache=cache, backend=backend, plans=_TRANSFER_WORKER["plans"])
+        for subset in subsets
+    ]
+
+
+def _transfer_record_chunk(subsets):
+    origin_model, target_model, origin_pars, target_pars, chance_transfer = _TRANSFER_WORKER["models"]
+    outputs = []
+    for subset in subsets:
+        bounds = dict()
+        outputs.append(_solve_transfer(subset, origin_model, target_model, origin_pars, target_pars, chance_transfer,
+                                       cache=_TRANSFER_WORKER["cache"], backend=_TRANSFER_WORKER["backend"],
+                                       bounds=bounds, plans=_TRANSFER_WORKER["plans"]) + (bounds,))
+    return outputs
+
+
+def _transfer_lattice_chunk(args):
+    variables, sizes, roots = args
+    origin_model, target_model, origin_pars, target_pars, chance_transfer = _TRANSFER_WORKER["models"]
+    return transfer_lattice(variables, sizes, origin_model, target_model, origin_pars, target_pars,
+                            chance_transfer, roots=roots, cache=_TRANSFER_WORKER["cache"],
+                            backend=_TRANSFER_WORKER["backend"], plans=_TRANSFER_WORKER["plans"])
+
+
+@profiled
+def evaluate_transfer_subsets(subsets, cu_parameters, pu_parameters, setting="informed_patient",
+                              max_workers=None, chunksize=64, cache_size=0, backend="limid"):
+    """
+    Solve the transfer of every subset in ``subsets`` over a process pool.
+
+    Subsets are split into chunks of ``chunksize`` work units; each worker builds the
+    clinician and patient models once with ``build_cid``/``build_pid``.
+    ``max_workers=1`` evaluates in the calling process. A positive ``cache_size`` gives
+    every worker a ``DecisionCache`` of that size; ``backend`` selects the solver.
+
+    Returns
+    -------
+    list of tuple
+        ``transfer_subset`` output per subset, in the order of ``subsets``
+    """
+    subsets = [tuple(subset) for subset in subsets]
+    chunks = [subsets[i:i + chunksize] for i in range(0, len(subsets), chunksize)]
+    initargs = (setting, cu_parameters, pu_parameters, cache_size, backend)
+
+    outputs = _ordered_map(_transfer_chunk, chunks, max_workers, _init_transfer_worker, initargs)
+    return [result for chunk in outputs for result in chunk]
+
+
+@profiled
+def transfer_sweep(analysis_variables, sizes, cu_parameters, pu_parameters, setting="informed_patient",
+                   max_workers=None, chunksize=64, mode="subsets", cache_size=0, backend="limid"):
+    """
+    Parallel version of the notebook's ``analysis``/``ca_analysis`` loops.
+
+    Every combination of ``analysis_variables`` of each size in ``sizes`` is transferred
+    according to ``setting`` (see ``TRANSFER_SETTINGS``) and solved.
+
+    Parameters
+    ----------
+    analysis_variables : iterable of str
+        Candidate variables; sets are sorted so the enumeration order is deterministic
+    sizes : iterable of int
+        Subset sizes, e.g. ``range(1, 13)``
+    cu_parameters, pu_parameters : dict
+        Unnormalised clinician and patient preference weights
+    mode : {"subsets", "lattice"}
+        ``"subsets"`` rebuilds every subset from the base models in chunks of
+        ``chunksize``; ``"lattice"`` uses ``transfer_lattice`` with one work unit per
+        first variable
+    cache_size : int
+        Size of the per-worker ``DecisionCache``; 0 disables memoization
+    backend : {"limid", "numpy", "sampling"}
+        Solver used by ``show_decision_utilities``; ``"sampling"`` stops once the optimal
+        treatment is separated and appends the MEU half-width and the separation flag
+        to every result
+
+    Returns
+    -------
+    dict
+        ``{size: {subset: [meu, decision]}}`` like ``results_informed_patient``
+    """
+    variables = _ordered_variables(analysis_variables)
+    sizes = list(sizes)
+    if mode == "lattice":
+        return _lattice_sweep(variables, sizes, cu_parameters, pu_parameters, setting, max_workers, cache_size,
+                              backend)
+    if mode != "subsets":
+        raise ValueError(f"Unknown sweep mode '{mode}'")
+
+    subsets = [subset for k in sizes for subset in itertools.combinations(variables, k)]
+    outputs = evaluate_transfer_subsets(subsets, cu_parameters, pu_parameters, setting, max_workers, chunksize,
+                                        cache_size, backend)
+
+    results = {k: dict() for k in sizes}
+    for subset, result in zip(subsets, outputs):
+        results[len(subset)][subset] = list(result)
+    return results
+
+
+def _lattice_sweep(variables, sizes, cu_parameters, pu_parameters, setting, max_workers, cache_size, backend):
+    initargs = (setting, cu_parameters, pu_parameters, cache_size, backend)
+    # The first branches hold most of the lattice, so they are submitted first
+    work = [(variables, sizes, (i,)) for i in range(len(variables))]
+    parts = _ordered_map(_transfer_lattice_chunk, work, max_workers, _init_transfer_worker, initargs,
+                         window=len(work))
+
+    # Branches are disjoint and each is lexicographic, so concatenating them in
+    # root order reproduces the itertools.combinations order
+    results = {k: dict() for k in sizes}
+    for part in parts:
+        for k in sizes:
+            results[k].update(part[k])
+    return results
+
+
+def _ordered_variables(variables):
+    if isinstance(variables, (set, frozenset)):
+        return sorted(variables)
+    return list(variables)
+
+
+class TransferDecomposition:
+    """
+    Expected utilities of every transfer subset from per-criterion tables.
+
+    After the transfers of a subset ``S`` the target utility is additive over criteria,
+    with the origin preference for the transferred criteria and the target preference
+    for the others (see ``transfer_subset``). The distribution of a criterion only
+    depends on the CPTs of its ancestors, and a transferred node takes the origin CPT
+    whatever else is transferred, so the score of criterion ``i`` only depends on
+    ``S & R_i``, the candidates among its ancestors in the union of the origin and
+    target graphs. The scores of every subset of ``R_i`` are computed once with NumPy
+    variable elimination; the expected utilities of any subset are then a sum of table
+    lookups.
+
+    Parameters
+    ----------
+    analysis_variables : iterable of str
+        Candidate variables; sets are sorted
+    origin_model, target_model : pyagrum.InfluenceDiagram
+        Models sharing the decision node, as passed to ``transfer_subset``
+    origin_utility_pars, target_utility_pars : dict
+        Unnormalised preference weights of the origin and target models
+    chance_transfer : bool
+        Transfer the chance nodes, as in ``transfer_subset``
+    increment : float
+        Increment per state of the utility tables
+
+    Attributes
+    ----------
+    variables : list of str
+    criteria : list of str
+    decision_labels : list of str
+    ancestors : list of list of str
+        ``R_i`` of each criterion, in the order of ``variables``
+    tables : list of numpy.ndarray
+        ``(2 ** len(R_i), decision states)`` weighted score of each criterion per subset
+        of ``R_i`` (bit ``j`` set when ``R_i[j]`` is transferred)
+    weights : list of numpy.ndarray
+        Unnormalised weight of each criterion per subset of ``R_i``
+
+    Examples
+    --------
+    >>> origin, target, o_pars, t_pars, chance = _transfer_models("informed_patient", cu, pu)
+    >>> decomposition = TransferDecomposition(variables, origin, target, o_pars, t_pars, chance)
+    >>> flip_search(decomposition)["minimal_flip_sets"]
+    """
+
+    def __init__(self, analysis_variables, origin_model, target_model, origin_utility_pars, target_utility_pars,
+                 chance_transfer=True, increment=100):
+        origin = origin_model if isinstance(origin_model, NumpyDiagram) else NumpyDiagram(origin_model)
+        target = target_model if isinstance(target_model, NumpyDiagram) else NumpyDiagram(target_model)
+        if origin.decision_name != target.decision_name or origin.decision_labels != target.decision_labels:
+            raise ValueError("Origin and target models must share the decision node")
+        self.variables = _ordered_variables(analysis_variables)
+        missing = [name for name in self.variables if name not in origin.cpts]
+        if missing:
+            raise ValueError(f"Cannot transfer {missing}: expected chance nodes of the origin model")
+        if not chance_transfer:
+            missing = [name for name in self.variables if name not in target.cpts]
+            if missing:
+                raise ValueError(f"Variables {missing} do not exist in target model. Apply chance node transfer first.")
+
+        self.decision_labels = list(origin.decision_labels)
+        self.chance_transfer = chance_transfer
+        self._origin = origin
+        self._target = target
+        self._index = {name: j for j, name in enumerate(self.variables)}
+
+        origin_criteria = set(origin.utility[1])
+        target_criteria = list(target.utility[1])
+        # Preferences are only transferred for origin utility parents, and with the chance
+        # transfer only for variables the target did not have
+        transferable = [name for name in self.variables
+                        if name in origin_criteria and not (chance_transfer and name in target.cpts)]
+        self.criteria = target_criteria + [name for name in transferable if name not in target_criteria]
+
+        self.ancestors, self.tables, self.weights = [], [], []
+        for name in self.criteria:
+            relevant = set(self._union_ancestors(name)) if chance_transfer else set()
+            if name in transferable:
+                relevant.add(name)
+            ancestors = [variable for variable in self.variables if variable in relevant]
+
+            num_states = len((origin.labels if name not in target.labels else target.labels)[name])
+            state_scores = (num_states - np.arange(num_states) - 1) * float(increment)
+            table = np.zeros((2 ** len(ancestors), len(self.decision_labels)))
+            weights = np.zeros(2 ** len(ancestors))
+            posteriors = dict()
+            for mask in range(2 ** len(ancestors)):
+                transferred = frozenset(ancestors[j] for j in range(len(ancestors)) if mask >> j & 1)
+                if name in transferable and name in transferred:
+                    weight = origin_utility_pars[name]
+                elif name in target_criteria:
+                    weight = target_utility_pars.get(name, 0.0)
+                else:
+                    continue
+                moved = transferred if chance_transfer else frozenset()
+                if moved not in posteriors:
+                    posteriors[moved] = self._posterior(name, moved) @ state_scores
+                table[mask] = weight * posteriors[moved]
+                weights[mask] = weight
+            self.ancestors.append(ancestors)
+            self.tables.append(table)
+            self.weights.append(weights)
+
+    def _parents(self, name):
+        parents = set(self._origin.parents.get(name, ())) | set(self._target.parents.get(name, ()))
+        return [parent for parent in parents if parent in self._origin.cpts or parent in self._target.cpts]
+
+    def _union_ancestors(self, name):
+        ancestors = set()
+        stack = [name]
+        while stack:
+            node = stack.pop()
+            if node in ancestors:
+                continue
+            ancestors.add(node)
+            stack.extend(self._parents(node))
+        return sorted(ancestors)
+
+    def _posterior(self, name, transferred):
+        """Distribution of ``name`` per decision state with the CPTs of ``transferred`` moved."""
+        decision = self._origin.decision_name
+        operands = []
+        for node in self._union_ancestors(name):
+            if node in transferred:
+                operands.append(self._origin.cpts[node])
+            elif node in self._target.cpts:
+                operands.append(self._target.cpts[node])
+            else:
+                # Parents added by chance_node_transfer get a uniform distribution
+                size = len(self._origin.labels[node])
+                operands.append((np.full(size, 1.0 / size), (node,)))
+        operands.append((np.ones(len(self.decision_labels)), (decision,)))
+        names = sorted({axis for _, axes in operands for axis in axes})
+        if len(names) > len(_EINSUM_LETTERS):
+            raise ValueError(f"'{name}' has more than {len(_EINSUM_LETTERS)} ancestors")
+        joint = _contract_named(operands, (decision, name), dict(zip(names, _EINSUM_LETTERS)))
+        return joint / joint.sum(axis=1, keepdims=True)
+
+    def masks(self, subset):
+        """Per-criterion bit masks of ``subset`` over ``ancestors``."""
+        positions = {self._index[name] for name in subset}
+        return [sum(1 << j for j, name in enumerate(ancestors) if self._index[name] in positions)
+                for ancestors in self.ancestors]
+
+    def expected_utilities(self, subset):
+        """Expected utility of each decision state after transferring ``subset``."""
+        masks = self.masks(subset)
+        total = sum(table[mask] for table, mask in zip(self.tables, masks))
+        return total / sum(weights[mask] for weights, mask in zip(self.weights, masks))
+
+    def decision(self, subset):
+        """MEU and optimal decision label after transferring ``subset``, like ``transfer_subset``."""
+        utilities = self.expected_utilities(subset)
+        best = int(np.argmax(utilities))
+        return float(utilities[best]), self.decision_labels[best]
+
+
+@profiled
+def flip_search(decomposition, sizes=None, tol=1e-9, block_size=16):
+    """
+    Branch-and-bound search for the smallest transfer sets that change the decision.
+
+    The subset lattice is walked depth first as in ``transfer_lattice``. At each subset
+    ``S`` every criterion's contribution to the margin between the optimal decision of
+    ``S`` and each other decision is bounded below by its minimum over the subsets of
+    ``R_i`` reachable from ``S``. When the bound is positive for all other decisions, no
+    extension of ``S`` changes the decision and the subtree is counted with binomial
+    coefficients instead of being visited. Subtrees over at most ``block_size``
+    remaining variables that cannot be pruned are evaluated at once with NumPy.
+
+    Parameters
+    ----------
+    decomposition : TransferDecomposition
+        Per-criterion tables of the transfer setting
+    sizes : iterable of int, optional
+        Subset sizes to count, all sizes by default; the search stops at ``max(sizes)``
+    tol : float
+        Margin, relative to the expected utilities, a bound must exceed to prune
+    block_size : int
+        Number of remaining variables below which subtrees are enumerated in bulk
+
+    Returns
+    -------
+    dict
+        - ``base_decision``: optimal decision without transfers
+        - ``minimal_flip_sets``: inclusion-minimal subsets (of at most ``max(sizes)``
+          variables) whose optimal decision differs from ``base_decision``
+        - ``counts``: DataFrame of the number of subsets per size and decision
+        - ``rates``: ``counts`` as fractions per size, like the notebook's ``meu_rates``
+        - ``visited``, ``pruned``: subsets evaluated and subsets covered by pruning
+    """
+    variables = decomposition.variables
+    n = len(variables)
+    sizes = set(range(1, n + 1)) if sizes is None else set(sizes)
+    max_size = max(sizes)
+    tables = decomposition.tables
+    labels = decomposition.decision_labels
+    counts = {k: np.zeros(len(labels), dtype=np.int64) for k in sorted(sizes)}
+
+    # Bits a variable sets in each criterion mask, and the bits still reachable from each start
+    variable_bits = [[] for _ in range(n)]
+    criterion_bits = []
+    reachable = []
+    for i, ancestors in enumerate(decomposition.ancestors):
+        positions = [variables.index(name) for name in ancestors]
+        for j, position in enumerate(positions):
+            variable_bits[position].append((i, 1 << j))
+        criterion_bits.append(list(zip(positions, (1 << j for j in range(len(positions))))))
+        reachable.append([sum(1 << j for j, position in enumerate(positions) if position >= start)
+                          for start in range(n + 1)])
+    all_masks = [np.arange(len(table)) for table in tables]
+    bound_cache = dict()
+
+    def margin_bound(i, mask, allowed, best):
+        key = (i, mask, allowed, best)
+        bound = bound_cache.get(key)
+        if bound is None:
+            masks = all_masks[i]
+            rows = tables[i][masks[(masks & ~allowed) == mask]]
+            bound = (rows[:, best][:, None] - rows).min(axis=0)
+            bound_cache[key] = bound
+        return bound
+
+    base_utilities = sum(table[0] for table in tables)
+    base = int(np.argmax(base_utilities))
+    candidates = []
+    stats = {"visited": 0, "pruned": 0}
+
+    block_cache = dict()
+
+    def block_layout(start):
+        # Extensions over the variables from start on, their sizes and per-criterion bits
+        layout = block_cache.get(start)
+        if layout is None:
+            width = n - start
+            extensions = np.arange(2 ** width)
+            bits = (extensions[:, None] >> np.arange(width)) & 1
+            local = []
+            for i in range(len(tables)):
+                deposit = np.zeros(len(extensions), dtype=np.int64)
+                for position, bit in criterion_bits[i]:
+                    if position >= start:
+                        deposit |= bits[:, position - start] * bit
+                local.append(deposit)
+            with_bit = [np.flatnonzero(extensions >> b & 1) for b in range(width)]
+            layout = block_cache[start] = (bits.sum(axis=1), local, with_bit)
+        return layout
+
+    def visit_block(subset, size, masks, start, flipped):
+        # Small subtrees are cheaper to enumerate with NumPy than to bound: every
+        # extension of the variables from start on is evaluated at once
+        extension_sizes, local, with_bit = block_layout(start)
+        utilities = np.zeros((len(extension_sizes), len(labels)))
+        for i, table in enumerate(tables):
+            utilities += table[local[i] | masks[i]]
+        best = np.argmax(utilities, axis=1)
+        sizes_below = extension_sizes + size
+        # Index 0 is the subset itself, already counted
+        stats["visited"] += int(np.count_nonzero(sizes_below[1:] <= max_size))
+        for k in sizes:
+            at_size = sizes_below == k
+            if k > size and at_size.any():
+                counts[k] += np.bincount(best[at_size], minlength=len(labels))
+        if flipped:
+            return
+
+        # Flipping extensions without a flipping proper subset inside the block
+        flips = (best != base) & (sizes_below <= max_size)
+        below = flips.copy()
+        for b, indices in enumerate(with_bit):
+            below[indices] |= below[indices ^ (1 << b)]
+        strictly_below = np.zeros_like(flips)
+        for b, indices in enumerate(with_bit):
+            strictly_below[indices] |= below[indices ^ (1 << b)]
+        for extension in np.flatnonzero(flips & ~strictly_below):
+            candidates.append(subset | int(extension) << start)
+
+    def visit(subset, size, masks, start, flipped):
+        for v in range(start, n):
+            child = subset | 1 << v
+            child_masks = list(masks)
+            for i, bit in variable_bits[v]:
+                child_masks[i] |= bit
+            utilities = sum(table[mask] for table, mask in zip(tables, child_masks))
+            best = int(np.argmax(utilities))
+            stats["visited"] += 1
+            if size + 1 in sizes:
+                counts[size + 1][best] += 1
+            # Supersets of a flipping subset found below it are not minimal
+            flips = best != base
+            if flips and not flipped:
+                candidates.append(child)
+            remaining = n - v - 1
+            if size + 1 >= max_size or remaining == 0:
+                continue
+
+            bound = np.zeros(len(labels))
+            for i, mask in enumerate(child_masks):
+                bound += margin_bound(i, mask, reachable[i][v + 1], best)
+            bound[best] = np.inf
+            if bound.min() > tol * max(1.0, np.abs(utilities).max()):
+                for extra in range(1, min(remaining, max_size - size - 1) + 1):
+                    if size + 1 + extra in sizes:
+                        counts[size + 1 + extra][best] += math.comb(remaining, extra)
+                    stats["pruned"] += math.comb(remaining, extra)
+            elif remaining <= block_size:
+                visit_block(child, size + 1, child_masks, v + 1, flipped or flips)
+            else:
+                visit(child, size + 1, child_masks, v + 1, flipped or flips)
+
+    visit(0, 0, [0] * len(tables), 0, False)
+
+    minimal = []
+    for candidate in sorted(candidates, key=lambda mask: bin(mask).count("1")):
+        if not any(kept & candidate == kept for kept in minimal):
+            minimal.append(candidate)
+    flip_sets = sorted((tuple(variables[j] for j in range(n) if mask >> j & 1) for mask in minimal),
+                       key=lambda subset: (len(subset), [variables.index(name) for name in subset]))
+
+    count_frame = pd.DataFrame([counts[k] for k in sorted(sizes)], index=sorted(sizes), columns=labels)
+    totals = count_frame.sum(axis=1).replace(0, 1)
+    return {
+        "base_decision": labels[base],
+        "minimal_flip_sets": flip_sets,
+        "counts": count_frame,
+        "rates": count_frame.div(totals, axis=0),
+        **stats,
+    }
+
+
+def _ordered_map(function, chunks, max_workers, initializer, initargs, window=None):
+    """
+    Lazily map ``function`` over ``chunks`` on a process pool, yielding results in order.
+
+    At most ``window`` chunks (twice the workers by default) are in flight, so neither
+    the pending work nor the finished results accumulate in memory. While profiling is
+    enabled the workers profile their chunks and the caller's profile receives them.
+    """
+    if max_workers == 1:
+        initializer(*initargs)
+        for chunk in chunks:
+            yield function(chunk)
+        return
+
+    profile = _PROFILE
+    if profile is not None:
+        initializer, initargs = _init_profiled_worker, (initializer, initargs)
+
+    def submit(executor, chunk):
+        if profile is None:
+            return executor.submit(function, chunk)
+        return executor.submit(_profiled_chunk, function, chunk)
+
+    def result(future):
+        if profile is None:
+            return future.result()
+        output, snapshot = future.result()
+        profile.merge(snapshot)
+        return output
+
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=initializer, initargs=initargs) as executor:
+        window = window or 2 * (max_workers or os.cpu_count() or 1)
+        pending = deque()
+        for chunk in chunks:
+            pending.append(submit(executor, chunk))
+            if len(pending) >= window:
+                yield result(pending.popleft())
+        while pending:
+            yield result(pending.popleft())
+
+
+def iter_transfer_sweep(analysis_variables, sizes, cu_parameters, pu_parameters, setting="informed_patient",
+                        max_workers=None, chunksize=64, start=0, patient=None, cache_size=0, backend="limid"):
+    """
+    Generator version of ``transfer_sweep`` yielding one record per subset.
+
+    Subsets are enumerated lazily in the order of ``transfer_sweep`` and solved over a
+    process pool with a bounded number of chunks in flight, so memory stays flat however
+    many subsets are swept.
+
+    Parameters
+    ----------
+    start : int
+        Number of leading subsets to skip, e.g. the records already written when resuming
+    patient : str, optional
+        Identifier stored in every record, to keep several patients in one result file
+
+    Yields
+    ------
+    dict
+        ``patient``, ``subset`` (tuple of str), ``size``, ``meu``, ``decision`` and
+        ``utilities`` (decision states mapped to their expected utilities); the
+        ``"sampling"`` backend adds ``meu_error`` and ``separated``
+    """
+    variables = _ordered_variables(analysis_variables)
+    subsets = (subset for k in sizes for subset in itertools.combinations(variables, k))
+    subsets = itertools.islice(subsets, start, None)
+    chunks = iter(lambda: list(itertools.islice(subsets, chunksize)), [])
+
+    # Subsets and results are paired through a bounded buffer of submitted chunks
+    submitted = deque()
+
+    def tracked_chunks():
+        for chunk in chunks:
+            submitted.append(chunk)
+            yield chunk
+
+    initargs = (setting, cu_parameters, pu_parameters, cache_size, backend)
+    for outputs in _ordered_map(_transfer_record_chunk, tracked_chunks(), max_workers, _init_transfer_worker, initargs):
+        for subset, (state_utilities, meu, meud, bounds) in zip(submitted.popleft(), outputs):
+            record = {
+                "patient": patient,
+                "subset": subset,
+                "size": len(subset),
+                "meu": meu,
+                "decision": meud,
+                "utilities": state_utilities,
+            }
+            if backend == "sampling":
+                record["meu_error"], record["separated"] = _sampling_bounds(backend, bounds, meud)
+            yield record
+
+
+# Separator of the variable names in the subset column of sweep files
+SUBSET_SEPARATOR = "|"
+
+_SWEEP_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+
+def _sweep_parts(path):
+    """Completed part files of a sweep directory, in write order."""
+    if not os.path.isdir(path):
+        return []
+    return sorted(
+        os.path.join(path, name) for name in os.listdir(path)
+        if name.startswith("part-") and os.path.splitext(name)[1] in _SWEEP_EXTENSIONS.values()
+    )
+
+
+def _sweep_format(path, format):
+    """Format of a sweep directory: that of its existing parts, else ``format`` or the best available."""
+    parts = _sweep_parts(path)
+    if parts:
+        existing = {extension: name for name, extension in _SWEEP_EXTENSIONS.items()}[os.path.splitext(parts[0])[1]]
+        if format is not None and format != existing:
+            raise ValueError(f"'{path}' already holds {existing} parts, cannot append {format}")
+        format = existing
+    if format is None:
+        format = "parquet" if pa is not None else "csv"
+    if format not in _SWEEP_EXTENSIONS:
+        raise ValueError(f"Unknown sweep format '{format}'")
+    if format != "csv" and pa is None:
+        raise ImportError(f"Writing {format} sweep files requires pyarrow")
+    return format
+
+
+def _record_rows(records):
+    """Columnar dict of a batch of sweep records."""
+    labels = list(records[0]["utilities"])
+    columns = {
+        "patient": [record["patient"] for record in records],
+        "subset": [SUBSET_SEPARATOR.join(record["subset"]) for record in records],
+        "size": np.array([record["size"] for record in records], dtype=np.int16),
+        "meu": np.array([record["meu"] for record in records]),
+        "decision": [record["decision"] for record in records],
+    }
+    for label in labels:
+        columns[f"utility_{label}"] = np.array([record["utilities"][label] for record in records])
+    if "meu_error" in records[0]:
+        columns["meu_error"] = np.array([record["meu_error"] for record in records])
+        columns["separated"] = np.array([record["separated"] for record in records])
+    if all(patient is None for patient in columns["patient"]):
+        del columns["patient"]
+    return columns
+
+
+def _write_part(path, index, columns, format):
+    name = os.path.join(path, f"part-{index:06d}{_SWEEP_EXTENSIONS[format]}")
+    partial = name + ".tmp"
+    if format == "csv":
+        pd.DataFrame(columns).to_csv(partial, index=False)
+    else:
+        table = pa.table(columns)
+        if format == "parquet":
+            pa.parquet.write_table(table, partial)
+        else:
+            with pa.ipc.new_file(partial, table.schema) as writer:
+                writer.write_table(table)
+    # A part only becomes visible once complete, so a crash never leaves a torn file
+    os.replace(partial, name)
+
+
+def write_sweep(records, path, batch_size=1024, format=None):
+    """
+    Write sweep records incrementally to a directory of columnar part files.
+
+    Every ``batch_size`` records are written as one part (Parquet by default, Arrow IPC,
+    or CSV when pyarrow is not installed). Parts are appended after the existing ones,
+    so a sweep can be resumed into the same directory.
+
+    Returns
+    -------
+    int
+        Number of records written
+    """
+    os.makedirs(path, exist_ok=True)
+    format = _sweep_format(path, format)
+    index = len(_sweep_parts(path))
+    written = 0
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= batch_size:
+            _write_part(path, index, _record_rows(batch), format)
+            index += 1
+            written += len(batch)
+            batch = []
+    if batch:
+        _write_part(path, index, _record_rows(batch), format)
+        written += len(batch)
+    return written
+
+
+def _read_part(part, columns=None):
+    extension = os.path.splitext(part)[1]
+    if extension == ".csv":
+        return pd.read_csv(part, usecols=columns, keep_default_na=False)
+    if extension == ".parquet":
+        return pa.parquet.read_table(part, columns=columns).to_pandas()
+    with pa.ipc.open_file(part) as reader:
+        table = reader.read_all()
+    return (table.select(columns) if columns else table).to_pandas()
+
+
+def completed_records(path, patient=None):
+    """Number of records already written to a sweep directory, for one patient if given."""
+    total = 0
+    for part in _sweep_parts(path):
+        if patient is None:
+            if part.endswith(".parquet"):
+                total += pa.parquet.ParquetFile(part).metadata.num_rows
+            else:
+                total += len(_read_part(part, ["subset"]))
+        else:
+            frame = _read_part(part)
+            if "patient" in frame:
+                total += int((frame["patient"].astype(str) == str(patient)).sum())
+    return total
+
+
+def read_sweep(path):
+    """Sweep directory as a DataFrame, with ``subset`` split back into tuples."""
+    parts = [_read_part(part) for part in _sweep_parts(path)]
+    if not parts:
+        return pd.DataFrame()
+    frame = pd.concat(parts, ignore_index=True)
+    frame["subset"] = [tuple(subset.split(SUBSET_SEPARATOR)) for subset in frame["subset"]]
+    return frame
+
+
+def resume_transfer_sweep(path, analysis_variables, sizes, cu_parameters, pu_parameters, setting="informed_patient",
+                          patient=None, batch_size=1024, format=None, **sweep_options):
+    """
+    Run ``iter_transfer_sweep`` into ``path``, continuing after the last completed subset.
+
+    Records already written for ``patient`` are counted and their subsets skipped, which
+    relies on the deterministic enumeration order of the sweep. Further keyword
+    arguments go to ``iter_transfer_sweep``.
+
+    Returns
+    -------
+    int
+        Number of records written by this call
+    """
+    start = completed_records(path, patient)
+    records = iter_transfer_sweep(analysis_variables, sizes, cu_parameters, pu_parameters, setting,
+                                  start=start, patient=patient, **sweep_options)
+    return write_sweep(records, path, batch_size, format)
+
+
+def _popcount(masks):
+    """Number of set bits of each int64 mask."""
+    values = np.ascontiguousarray(masks, dtype=np.int64).view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(values, axis=1).sum(axis=1).astype(np.int8)
+
+
+class ResultStore:
+    """
+    Columnar sweep results with subsets stored as bit masks over a fixed variable index.
+
+    Bit ``j`` of a mask is set when ``variables[j]`` is transferred. MEUs are stored as
+    float32 and decisions as int8 codes into ``decision_labels``; several patients can
+    share a store through int32 codes into ``patient_labels``. Queries are vectorized
+    over the arrays, and ``save``/``load`` keep them as ``.npy`` files that are memory
+    mapped on load.
+
+    Parameters
+    ----------
+    variables : list of str
+        Variable of each bit, at most 63
+    decision_labels : list of str
+    masks, meu, decision : array_like
+        One entry per result
+    patients : array_like of int, optional
+        Patient code of each result
+    patient_labels : list, optional
+        Identifier of each patient code
+    """
+
+    def __init__(self, variables, decision_labels, masks, meu, decision, patients=None, patient_labels=None):
+        if len(variables) > 63:
+            raise ValueError(f"ResultStore supports at most 63 variables, got {len(variables)}")
+        self.variables = list(variables)
+        self.decision_labels = list(decision_labels)
+        self.masks = np.asanyarray(masks, dtype=np.int64)
+        self.meu = np.asanyarray(meu, dtype=np.float32)
+        self.decision = np.asanyarray(decision, dtype=np.int8)
+        self.patients = None if patients is None else np.asanyarray(patients, dtype=np.int32)
+        self.patient_labels = None if patient_labels is None else list(patient_labels)
+        self._index = {name: j for j, name in enumerate(self.variables)}
+        self._sizes = None
+        self._sorted = None
+
+    @classmethod
+    def from_sweep(cls, results, decision_labels, variables=None):
+        """
+        Store of a ``{size: {subset: [meu, decision]}}`` dict as returned by ``transfer_sweep``.
+
+        ``decision_labels`` is the decision node's label list, or the swept target model
+        (``pyagrum.InfluenceDiagram`` or ``NumpyDiagram``) to read it from, so treatments
+        that no subset chose keep their code.
+        """
+        subsets = [subset for per_size in results.values() for subset in per_size]
+        values = [value for per_size in results.values() for value in per_size.values()]
+        return cls._from_columns(subsets, [value[0] for value in values], [value[1] for value in values],
+                                 None, variables, decision_labels)
+
+    @classmethod
+    def from_records(cls, records, decision_labels, variables=None):
+        """Store of ``iter_transfer_sweep`` records or a ``read_sweep`` DataFrame, see ``from_sweep``."""
+        if isinstance(records, pd.DataFrame):
+            frame = records
+            patients = frame["patient"].tolist() if "patient" in frame else None
+            return cls._from_columns(frame["subset"].tolist(), frame["meu"].to_numpy(), frame["decision"].tolist(),
+                                     patients, variables, decision_labels)
+        subsets, meus, decisions, patients = [], [], [], []
+        for record in records:
+            subsets.append(record["subset"])
+            meus.append(record["meu"])
+            decisions.append(record["decision"])
+            patients.append(record.get("patient"))
+        if all(patient is None for patient in patients):
+            patients = None
+        return cls._from_columns(subsets, meus, decisions, patients, variables, decision_labels)
+
+    @classmethod
+    def _from_columns(cls, subsets, meus, decisions, patients, variables, decision_labels):
+        if variables is None:
+            variables = sorted({name for subset in subsets for name in subset})
+        if isinstance(decision_labels, NumpyDiagram):
+            decision_labels = decision_labels.decision_labels
+        elif isinstance(decision_labels, gum.InfluenceDiagram):
+            decision_nodes = [node for node in decision_labels.nodes() if decision_labels.isDecisionNode(node)]
+            decision_labels = decision_labels.variable(decision_nodes[0]).labels()
+        decision_labels = list(decision_labels)
+        unknown = sorted(set(decisions) - set(decision_labels))
+        if unknown:
+            raise ValueError(f"Decisions {unknown} are not in decision_labels {decision_labels}")
+        index = {name: j for j, name in enumerate(variables)}
+        masks = np.fromiter((sum(1 << index[name] for name in subset) for subset in subsets),
+                            dtype=np.int64, count=len(subsets))
+        codes = {label: i for i, label in enumerate(decision_labels)}
+        decision = np.fromiter((codes[label] for label in decisions), dtype=np.int8, count=len(decisions))
+        patient_codes = patient_labels = None
+        if patients is not None:
+            patient_labels = list(dict.fromkeys(patients))
+            patient_index = {patient: i for i, patient in enumerate(patient_labels)}
+            patient_codes = np.fromiter((patient_index[patient] for patient in patients), dtype=np.int32,
+                                        count=len(patients))
+        return cls(variables, decision_labels, masks, meus, decision, patient_codes, patient_labels)
+
+    def __len__(self):
+        return len(self.masks)
+
+    @property
+    def sizes(self):
+        """Number of transferred variables of each result."""
+        if self._sizes is None:
+            self._sizes = _popcount(self.masks)
+        return self._sizes
+
+    def mask(self, subset):
+        """Bit mask of a subset of variable names."""
+        return sum(1 << self._index[name] for name in subset)
+
+    def subsets(self, rows=None):
+        """Subsets of the results (of ``rows`` if given) as tuples of variable names."""
+        masks = self.masks if rows is None else self.masks[rows]
+        return [tuple(name for j, name in enumerate(self.variables) if mask >> j & 1) for mask in masks.tolist()]
+
+    def contains(self, *variables):
+        """Boolean array of the results whose subset contains all ``variables``."""
+        mask = self.mask(variables)
+        return (self.masks & mask) == mask
+
+    def select(self, rows):
+        """Store restricted to ``rows`` (a boolean or index array)."""
+        patients = None if self.patients is None else self.patients[rows]
+        return ResultStore(self.variables, self.decision_labels, self.masks[rows], self.meu[rows],
+                           self.decision[rows], patients, self.patient_labels)
+
+    def containing(self, *variables):
+        """Store of the results whose subset contains all ``variables``."""
+        return self.select(self.contains(*variables))
+
+    def for_patient(self, patient):
+        """Store of the results of one patient."""
+        if self.patients is None:
+            raise ValueError("The store holds no patient identifiers")
+        return self.select(self.patients == self.patient_labels.index(patient))
+
+    def _keys(self):
+        width = len(self.variables)
+        if self.patients is None:
+            return self.masks
+        if width + int(np.ceil(np.log2(len(self.patient_labels) + 1))) > 63:
+            raise ValueError("Too many variables and patients to pair results")
+        return self.patients.astype(np.int64) << width | self.masks
+
+    def _sorted_keys(self):
+        if self._sorted is None:
+            keys = self._keys()
+            order = np.argsort(keys, kind="stable")
+            self._sorted = (keys[order], order)
+        return self._sorted
+
+    def _find(self, keys):
+        """Row of each key, -1 where the store has no such result."""
+        sorted_keys, order = self._sorted_keys()
+        position = np.clip(np.searchsorted(sorted_keys, keys), 0, max(len(sorted_keys) - 1, 0))
+        found = len(sorted_keys) > 0
+        found = found & (sorted_keys[position] == keys) if found else np.zeros(len(keys), dtype=bool)
+        return np.where(found, order[position], -1)
+
+    def lookup(self, subset, patient=None):
+        """``(meu, decision)`` of a subset, ``None`` if it is not stored."""
+        key = self.mask(subset)
+        if patient is not None:
+            key |= self.patient_labels.index(patient) << len(self.variables)
+        row = self._find(np.array([key], dtype=np.int64))[0]
+        if row < 0:
+            return None
+        return float(self.meu[row]), self.decision_labels[self.decision[row]]
+
+    def decision_counts(self):
+        """DataFrame of the number of results per subset size and decision."""
+        labels = len(self.decision_labels)
+        sizes = self.sizes.astype(np.int64)
+        counts = np.bincount(sizes * labels + self.decision, minlength=(len(self.variables) + 1) * labels)
+        counts = counts.reshape(-1, labels)
+        present = np.flatnonzero(counts.sum(axis=1))
+        return pd.DataFrame(counts[present], index=present, columns=self.decision_labels)
+
+    def decision_rates(self):
+        """Decision frequencies per subset size, the table built from ``meu_rates`` in the notebook."""
+        counts = self.decision_counts()
+        return counts.div(counts.sum(axis=1), axis=0)
+
+    def marginal_effects(self):
+        """
+        Effect of adding each variable to the subsets that do not contain it.
+
+        Every stored subset ``S`` without variable ``X`` is paired with ``S + X`` when
+        that is stored too (for the same patient).
+
+        Returns
+        -------
+        pandas.DataFrame
+            Per variable: the number of pairs, the mean MEU change, the fraction of pairs
+            whose decision changes, and the mean MEU of the results with and without it
+        """
+        keys = self._keys()
+        rows = []
+        for j, name in enumerate(self.variables):
+            bit = np.int64(1) << j
+            has = (self.masks & bit) != 0
+            partner = self._find(keys[~has] | bit)
+            paired = partner >= 0
+            without = np.flatnonzero(~has)[paired]
+            with_ = partner[paired]
+            change = self.meu[with_].astype(float) - self.meu[without]
+            rows.append({
+                "pairs": int(paired.sum()),
+                "meu_change": change.mean() if len(change) else np.nan,
+                "flip_rate": (self.decision[with_] != self.decision[without]).mean() if len(change) else np.nan,
+                "meu_with": self.meu[has].mean(dtype=float) if has.any() else np.nan,
+                "meu_without": self.meu[~has].mean(dtype=float) if (~has).any() else np.nan,
+            })
+        return pd.DataFrame(rows, index=self.variables)
+
+    def to_results(self):
+        """``{size: {subset: [meu, decision]}}`` dict like ``transfer_sweep`` (single patient)."""
+        results = dict()
+        for subset, meu, code in zip(self.subsets(), self.meu.tolist(), self.decision.tolist()):
+            results.setdefault(len(subset), dict())[subset] = [meu, self.decision_labels[code]]
+        return {k: results[k] for k in sorted(results)}
+
+    def save(self, path):
+        """Write the arrays as ``.npy`` files and the labels as ``meta.json`` into directory ``path``."""
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "masks.npy"), self.masks)
+        np.save(os.path.join(path, "meu.npy"), self.meu)
+        np.save(os.path.join(path, "decision.npy"), self.decision)
+        if self.patients is not None:
+            np.save(os.path.join(path, "patients.npy"), self.patients)
+        meta = {"variables": self.variables, "decision_labels": self.decision_labels,
+                "patient_labels": self.patient_labels}
+        with open(os.path.join(path, "meta.json"), "w") as handle:
+            json.dump(meta, handle)
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """Store saved by ``save``, with the arrays memory mapped by default."""
+        with open(os.path.join(path, "meta.json")) as handle:
+            meta = json.load(handle)
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in ("masks", "meu", "decision")}
+        patients = None
+        if meta["patient_labels"] is not None:
+            patients = np.load(os.path.join(path, "patients.npy"), mmap_mode=mmap_mode)
+        return cls(meta["variables"], meta["decision_labels"], arrays["masks"], arrays["meu"], arrays["decision"],
+                   patients, meta["patient_labels"])
+
+
+def wilson_interval(count, total, z=1.96):
+    """Wilson score interval of a proportion; arrays are handled elementwise."""
+    count = np.asarray(count, dtype=float)
+    total = np.asarray(total, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        p = count / total
+        denominator = 1 + z ** 2 / total
+        centre = (p + z ** 2 / (2 * total)) / denominator
+        half = z * np.sqrt(p * (1 - p) / total + z ** 2 / (4 * total ** 2)) / denominator
+    return centre - half, centre + half
+
+
+class DialogueSimulator:
+    """
+    Monte Carlo simulation of the order in which an SDM dialogue exchanges information.
+
+    At step ``i`` of a dialogue the patient has received the first ``i`` clinician
+    variables of a random order (informed patient setting) and the clinician the first
+    ``i`` patient preferences of another random order (clinician as agent setting); a
+    channel that ran out keeps all its variables. The dialogue stops at the first step
+    where both decisions agree. This replaces the step-wise product of the
+    ``meu_rates`` tables in the notebook, which treats each step as an independent,
+    unordered draw.
+
+    The decision of a subset does not depend on the order of its transfers, so decisions
+    are memoized per ``frozenset`` in ``outcomes`` and every distinct subset is solved
+    once, with ``evaluate_transfer_subsets``, however many dialogues reach it.
+
+    Parameters
+    ----------
+    clinician_variables, patient_variables : iterable of str
+        Variables the informed patient and the clinician as agent can receive
+    cu_parameters, pu_parameters : dict
+        Unnormalised clinician and patient preference weights
+    max_workers, chunksize, cache_size, backend
+        Passed on to ``evaluate_transfer_subsets``
+
+    Attributes
+    ----------
+    outcomes : dict
+        Setting mapped to ``{frozenset: decision}`` of the subsets solved so far
+    """
+
+    settings = ("informed_patient", "clinician_agent")
+
+    def __init__(self, clinician_variables, patient_variables, cu_parameters, pu_parameters, max_workers=None,
+                 chunksize=64, cache_size=0, backend="limid"):
+        self.variables = {
+            "informed_patient": _ordered_variables(clinician_variables),
+            "clinician_agent": _ordered_variables(patient_variables),
+        }
+        self.cu_parameters = cu_parameters
+        self.pu_parameters = pu_parameters
+        self.options = dict(max_workers=max_workers, chunksize=chunksize, cache_size=cache_size, backend=backend)
+        self.outcomes = {setting: dict() for setting in self.settings}
+        target = build_pid(pu_parameters)
+        self.decision_labels = list(NumpyDiagram(target).decision_labels)
+
+    def decisions(self, setting, subsets):
+        """Decision labels of ``subsets`` in ``setting``, solving only the unseen ones."""
+        subsets = [frozenset(subset) for subset in subsets]
+        outcomes = self.outcomes[setting]
+        missing = list(dict.fromkeys(subset for subset in subsets if subset not in outcomes))
+        if missing:
+            order = {name: i for i, name in enumerate(self.variables[setting])}
+            ordered = [tuple(sorted(subset, key=order.get)) for subset in missing]
+            results = evaluate_transfer_subsets(ordered, self.cu_parameters, self.pu_parameters, setting,
+                                                **self.options)
+            outcomes.update((subset, result[1]) for subset, result in zip(missing, results))
+        return [outcomes[subset] for subset in subsets]
+
+    def _step_codes(self, setting, rng, n_dialogues, steps):
+        """Decision index of each dialogue and step for one channel."""
+        variables = self.variables[setting]
+        # Random orders as prefix bit masks: mask[:, i] holds the first i + 1 variables
+        order = np.argsort(rng.random((n_dialogues, len(variables))), axis=1)
+        masks = np.bitwise_or.accumulate(np.left_shift(1, order, dtype=np.int64), axis=1)
+        masks = masks[:, np.minimum(np.arange(steps), len(variables) - 1)]
+
+        unique, inverse = np.unique(masks, return_inverse=True)
+        subsets = [frozenset(variables[j] for j in range(len(variables)) if mask >> j & 1) for mask in unique.tolist()]
+        index = {label: i for i, label in enumerate(self.decision_labels)}
+        codes = np.array([index[decision] for decision in self.decisions(setting, subsets)])
+        return codes[inverse.reshape(masks.shape)]
+
+    def simulate(self, n_dialogues=10000, steps=None, seed=None, batch_size=100000):
+        """
+        Simulate ``n_dialogues`` random dialogues of at most ``steps`` steps.
+
+        Returns
+        -------
+        dict
+            - ``stop_step``: step at which each dialogue agreed, 0 if it never did
+            - ``treatment``: index into ``decision_labels`` of the agreed treatment, -1 if none
+            - ``decision_labels``: labels of the decision states
+            - ``treatments``: DataFrame with count, probability and 95% Wilson interval
+              per agreed treatment and ``"no agreement"``
+            - ``stopping_steps``: the same per stopping step
+            - ``joint``: probability of stopping at each step with each treatment, the
+              counterpart of the notebook's ``probs``
+            - ``mean_steps``: mean stopping step of the agreeing dialogues and its 95%
+              confidence interval
+            - ``solved``: number of distinct subsets solved, over all calls
+        """
+        if steps is None:
+            steps = max(len(variables) for variables in self.variables.values())
+        rng = np.random.default_rng(seed)
+        stop_step = np.zeros(n_dialogues, dtype=np.int64)
+        treatment = np.full(n_dialogues, -1, dtype=np.int64)
+        for start in range(0, n_dialogues, batch_size):
+            size = min(batch_size, n_dialogues - start)
+            patient = self._step_codes("informed_patient", rng, size, steps)
+            clinician = self._step_codes("clinician_agent", rng, size, steps)
+            agree = patient == clinician
+            agreed = agree.any(axis=1)
+            first = np.argmax(agree, axis=1)
+            stop_step[start:start + size] = np.where(agreed, first + 1, 0)
+            treatment[start:start + size] = np.where(agreed, patient[np.arange(size), first], -1)
+
+        labels = self.decision_labels + ["no agreement"]
+        treatment_counts = np.bincount(np.where(treatment < 0, len(self.decision_labels), treatment),
+                                       minlength=len(labels))
+        step_index = list(range(1, steps + 1)) + ["no agreement"]
+        step_counts = np.bincount(np.where(stop_step == 0, steps + 1, stop_step), minlength=steps + 2)[1:]
+
+        joint = np.zeros((steps, len(self.decision_labels)))
+        np.add.at(joint, (stop_step[stop_step > 0] - 1, treatment[stop_step > 0]), 1)
+        agreed_steps = stop_step[stop_step > 0]
+        if len(agreed_steps) > 1:
+            half = 1.96 * agreed_steps.std(ddof=1) / np.sqrt(len(agreed_steps))
+            mean_steps = (agreed_steps.mean(), agreed_steps.mean() - half, agreed_steps.mean() + half)
+        else:
+            mean_steps = (float(agreed_steps.mean()) if len(agreed_steps) else np.nan, np.nan, np.nan)
+
+        return {
+            "stop_step": stop_step,
+            "treatment": treatment,
+            "decision_labels": self.decision_labels,
+            "treatments": _proportion_frame(treatment_counts, n_dialogues, labels),
+            "stopping_steps": _proportion_frame(step_counts, n_dialogues, step_index),
+            "joint": pd.DataFrame(joint / n_dialogues, index=range(1, steps + 1), columns=self.decision_labels),
+            "mean_steps": mean_steps,
+            "solved": sum(len(outcomes) for outcomes in self.outcomes.values()),
+        }
+
+
+def _proportion_frame(counts, total, index):
+    lower, upper = wilson_interval(counts, total)
+    return pd.DataFrame({"count": counts, "p": counts / total, "lower": lower, "upper": upper}, index=index)
@@ -0,0 +1,328 @@
+"""
+Asyncio decision service for the SDM models.
+
+Serves treatment recommendations over HTTP (or a Unix socket) using only the standard
+library. ``POST /recommend`` takes a JSON body such as::
+
+    {"model": "patient",
+     "weights": {"remission": 1, "hypothyroidism": 0, "cost": 1, "lifelong_thyroid_replacement": 2},
+     "evidence": {"smoking": "1"}, "voe": 5}
+
+and returns the ``show_decision_utilities`` output (``decision_utilities``, ``meu``,
+``decision``) and the ``voe`` top value-of-evidence items. ``GET /health`` reports the
+model cache and batching statistics.
+
+Concurrent requests are collected for a few milliseconds into micro-batches. A batch is
+solved in an executor, so the event loop never blocks: requests on the same model share
+one ``batched_decision_utilities`` / ``batched_voe`` contraction. Compiled models are kept
+warm in an LRU cache keyed by the model and its weights.
+
+Run with ``python sdm_service.py --port 8080`` or ``python sdm_service.py --unix sdm.sock``.
+"""
+import argparse
+import asyncio
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from sdm_fun import NumpyDiagram, batched_decision_utilities, batched_voe, build_cid, build_pid
+
+BUILDERS = {"clinician": build_cid, "patient": build_pid}
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class ModelCache:
+    """
+    LRU cache of compiled models keyed by model name and preference weights.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of compiled models kept warm
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model, weights):
+        return model, tuple(sorted((name, float(value)) for name, value in weights.items()))
+
+    def get(self, model, weights):
+        """``NumpyDiagram`` of the named model with its utility built from ``weights``."""
+        if model not in BUILDERS:
+            raise ValueError(f"Unknown model '{model}', expected one of {sorted(BUILDERS)}")
+        key = self.key(model, weights)
+        with self._lock:
+            compiled = self._models.get(key)
+            if compiled is not None:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+        compiled = NumpyDiagram(BUILDERS[model](dict(weights)))
+        with self._lock:
+            self._models[key] = compiled
+            while len(self._models) > self.maxsize:
+                self._models.popitem(last=False)
+        return compiled
+
+    def stats(self):
+        return {"size": len(self._models), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
+
+
+def parse_request(payload):
+    """Validated ``(model, weights, evidence, voe)`` of a request body."""
+    if not isinstance(payload, dict):
+        raise ValueError("Request body must be a JSON object")
+    model = payload.get("model", "patient")
+    weights = payload.get("weights")
+    evidence = payload.get("evidence", {})
+    top = payload.get("voe", 5)
+    if not isinstance(weights, dict) or not weights:
+        raise ValueError("'weights' must be a non-empty object of criterion weights")
+    # json.loads accepts NaN and Infinity, which would make every utility NaN
+    if not all(isinstance(value, (int, float)) and math.isfinite(value) for value in weights.values()):
+        raise ValueError("'weights' must be finite numbers")
+    if sum(weights.values()) <= 0:
+        raise ValueError("'weights' must have a positive sum")
+    if not isinstance(evidence, dict):
+        raise ValueError("'evidence' must be an object of node labels")
+    if not isinstance(top, int) or top < 0:
+        raise ValueError("'voe' must be a non-negative integer")
+    return model, weights, evidence, top
+
+
+def solve_batch(cache, payloads):
+    """
+    Responses to a batch of request bodies; failed requests get an ``error`` entry.
+
+    Requests on the same compiled model are solved together.
+    """
+    responses = [None] * len(payloads)
+    groups = dict()
+    for i, payload in enumerate(payloads):
+        try:
+            model, weights, evidence, top = parse_request(payload)
+            compiled = cache.get(model, weights)
+            for name, value in evidence.items():
+                compiled.evidence_vector(name, value)
+        except (ValueError, TypeError, KeyError) as error:
+            responses[i] = {"error": str(error)}
+            continue
+        groups.setdefault(id(compiled), (compiled, []))[1].append((i, evidence, top))
+
+    for compiled, requests in groups.values():
+        evidences = [evidence for _, evidence, _ in requests]
+        # Stacking every chance node keeps one contraction order per model whatever the evidence
+        observable = list(compiled.cpts)
+        utilities = batched_decision_utilities(compiled, evidences, observable)
+        wanted = [k for k, (_, _, top) in enumerate(requests) if top > 0]
+        voes = dict(zip(wanted, batched_voe(compiled, [evidences[k] for k in wanted], observable=observable)))
+        labels = compiled.decision_labels
+        for k, (i, _, top) in enumerate(requests):
+            best = int(np.argmax(utilities[k]))
+            response = {
+                "decision_utilities": dict(zip(labels, utilities[k].tolist())),
+                "meu": float(utilities[k, best]),
+                "decision": labels[best],
+                "voe": [],
+            }
+            if k in voes:
+                result = voes[k]
+                order = np.argsort(-np.nan_to_num(result["utility"], nan=-np.inf), kind="stable")[:top]
+                response["voe"] = [
+                    {"node": str(result["node"][j]), "label": str(result["label"][j]),
+                     "utility": float(result["utility"][j])}
+                    for j in order]
+            responses[i] = response
+    return responses
+
+
+class MicroBatcher:
+    """
+    Collects concurrent requests and solves them together in an executor.
+
+    A batch is dispatched when ``max_batch`` requests are waiting or ``max_delay``
+    seconds after its first request arrived.
+    """
+
+    def __init__(self, solve, executor, max_batch=64, max_delay=0.002):
+        self.solve = solve
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.batches = 0
+        self.requests = 0
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_delay, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        self.batches += 1
+        self.requests += len(batch)
+        loop = asyncio.get_running_loop()
+        try:
+            responses = await loop.run_in_executor(self.executor, self.solve, [payload for payload, _ in batch])
+        except Exception as error:
+            responses = [error] * len(batch)
+        for (_, future), response in zip(batch, responses):
+            if future.done():
+                continue
+            if isinstance(response, Exception):
+                future.set_exception(response)
+            else:
+                future.set_result(response)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "requests": self.requests,
+            "mean_batch": self.requests / self.batches if self.batches else 0.0,
+        }
+
+
+class DecisionService:
+    """
+    HTTP/1.1 front-end of ``solve_batch`` with keep-alive connections.
+
+    Parameters
+    ----------
+    workers : int
+        Executor threads solving batches
+    cache_size : int
+        Compiled models kept in the ``ModelCache``
+    max_batch, max_delay
+        Micro-batching limits, see ``MicroBatcher``
+    """
+
+    def __init__(self, workers=1, cache_size=128, max_batch=64, max_delay=0.002):
+        self.cache = ModelCache(cache_size)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.batcher = MicroBatcher(lambda payloads: solve_batch(self.cache, payloads), self.executor,
+                                    max_batch, max_delay)
+        self.started = time.time()
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                status, response = await self.route(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                write_response(writer, status, response, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except ValueError as error:
+            write_response(writer, 400, {"error": str(error)}, False)
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if path == "/health":
+            return 200, {
+                "status": "ok",
+                "uptime": time.time() - self.started,
+                "cache": self.cache.stats(),
+                "batching": self.batcher.stats(),
+            }
+        if path != "/recommend":
+            return 404, {"error": f"Unknown path '{path}'"}
+        if method != "POST":
+            return 405, {"error": "Use POST for /recommend"}
+        try:
+            payload = json.loads(body or b"null")
+        except json.JSONDecodeError as error:
+            return 400, {"error": f"Invalid JSON: {error}"}
+        try:
+            response = await self.batcher.submit(payload)
+        except Exception as error:
+            return 500, {"error": str(error)}
+        return (400 if "error" in response else 200), response
+
+    async def serve(self, host="127.0.0.1", port=8080, unix=None):
+        if unix:
+            server = await asyncio.start_unix_server(self.handle, path=unix)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+
+async def read_request(reader):
+    """``(method, path, headers, body)`` of the next request, None at end of stream."""
+    line = await reader.readline()
+    if not line:
+        return None
+    parts = line.decode("latin-1").split()
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    method, path, _ = parts
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    body = await reader.readexactly(length) if length else b""
+    return method, path.split("?", 1)[0], headers, body
+
+
+def write_response(writer, status, payload, keep_alive=True):
+    body = json.dumps(payload).encode()
+    head = (f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+    writer.write(head.encode() + body)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--unix", help="serve on this Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=1, help="executor threads solving batches")
+    parser.add_argument("--cache-size", type=int, default=128, help="compiled models kept warm")
+    parser.add_argument("--max-batch", type=int, default=64, help="largest micro-batch")
+    parser.add_argument("--max-delay", type=float, default=2.0, help="milliseconds a batch waits for requests")
+    args = parser.parse_args()
+
+    service = DecisionService(args.workers, args.cache_size, args.max_batch, args.max_delay / 1000)
+    try:
+        asyncio.run(service.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,112 @@
+import numpy as np
+import pyAgrum as gum
+import pytest
+
+import models
+from sdm_fun import (
+    ResultStore,
+    build_cid,
+    build_pid,
+    check_numpy_backend,
+    compile_policy_table,
+    probabilistic_sensitivity,
+    show_decision_utilities,
+    tornado,
+)
+
+CU_PARAMETERS = {
+    "remission": 1/7,
+    "hypoparathyroidism": 1/7,
+    "laryngeal": 1/7,
+    "hepatoxicity": 1/7,
+    "agranulocytosis": 1/7,
+    "hypothyroidism": 1/7,
+    "eye_post": 1/7,
+}
+PU_PARAMETERS = {"remission": 1, "hypothyroidism": 0, "cost": 1, "lifelong_thyroid_replacement": 2}
+
+
+@pytest.fixture(scope="module")
+def cid():
+    return build_cid(CU_PARAMETERS)
+
+
+@pytest.fixture(scope="module")
+def pid():
+    return build_pid(PU_PARAMETERS)
+
+
+def test_numpy_backend_matches_limid_on_clinician(cid):
+    assert check_numpy_backend(cid) <= 1e-8
+    assert check_numpy_backend(cid, [
+        {"smoking": "yes", "goiter": "Large"},
+        {"hyperthyroidism": "yes", "eye disease": "yes", "Pre_TSH_Level": "2"},
+        {"remission": "no", "hypothyroidism": "yes", "smoking": "no"},
+        {"Pre_TSH_Level": [0.2, 0.5, 0.3], "smoking": [0.9, 0.1]},
+    ]) <= 1e-8
+
+
+def test_numpy_backend_matches_limid_on_patient(pid):
+    assert check_numpy_backend(pid) <= 1e-8
+    assert check_numpy_backend(pid, [
+        {"smoking": "1", "goiter": "0"},
+        {"hyperthyroidism": "yes", "smoking": "0", "goiter": "1"},
+        {"remission": "1", "cost": "0"},
+        {"smoking": [0.3, 0.7]},
+    ]) <= 1e-8
+
+
+def test_tornado_flip_below_base_value(cid):
+    optimal = show_decision_utilities(cid)[2]
+    ranking = tornado(cid)
+    row = ranking[(ranking["node"] == "remission") & ranking["flips"]].iloc[0]
+    assert row["threshold"] < row["base"]
+    assert row["flip_to"] != optimal
+
+    # Remission is binary, so its first label determines the whole CPT row
+    model = gum.InfluenceDiagram(cid)
+    parents = dict(item.split("=") for item in row["parents"].split(", "))
+    value = row["threshold"] - 0.01
+    model.cpt("remission")[parents] = [value, 1 - value]
+    assert show_decision_utilities(model)[2] == row["flip_to"]
+
+
+def test_result_store_keeps_unchosen_treatments(pid):
+    results = {
+        1: {("cost",): [60.0, "RAI"], ("remission",): [57.5, "antithyroid"]},
+        2: {("cost", "remission"): [61.0, "RAI"]},
+    }
+    store = ResultStore.from_sweep(results, pid)
+
+    assert store.decision_labels == ["antithyroid", "RAI", "thyroidectomy"]
+    assert store.decision_counts()["thyroidectomy"].tolist() == [0, 0]
+    assert ResultStore.from_sweep({1: {("cost",): [60.0, "RAI"]}}, pid).decision.tolist() == [1]
+    with pytest.raises(ValueError):
+        ResultStore.from_sweep({1: {("cost",): [60.0, "surgery"]}}, pid)
+
+
+def test_probabilistic_sensitivity_builds_weighted_model(pid):
+    by_name = probabilistic_sensitivity("patient", PU_PARAMETERS, n_samples=50, groups={}, seed=0)
+    by_model = probabilistic_sensitivity(pid, n_samples=50, groups={}, seed=0)
+
+    assert by_name["expected_utilities"].equals(by_model["expected_utilities"])
+    assert by_name["expected_utilities"].max() > 0
+    with pytest.raises(ValueError):
+        probabilistic_sensitivity("patient", n_samples=50, groups={})
+    with pytest.raises(ValueError):
+        probabilistic_sensitivity(models.model_copy("patient"), n_samples=50, groups={})
+
+
+def test_policy_table_matches_limid(cid):
+    table = compile_policy_table("clinician", CU_PARAMETERS)
+    rng = np.random.default_rng(0)
+    for code in rng.choice(len(table), size=25, replace=False):
+        evidence = table.evidence(int(code))
+        utilities, meu, decision = show_decision_utilities(cid, evidence)
+        table_utilities, table_meu, table_decision = table.lookup(evidence)
+        assert table_decision == decision
+        assert np.isclose(table_meu, meu)
+        assert np.allclose(list(table_utilities.values()), list(utilities.values()))
+
+    with pytest.raises(ValueError):
+        compile_policy_table("clinician")
@@ -0,0 +1,46 @@
+import json
+
+import pytest
+
+from sdm_service import ModelCache, solve_batch
+
+WEIGHTS = {"remission": 1, "hypothyroidism": 0, "cost": 1, "lifelong_thyroid_replacement": 2}
+
+
+def request(evidence):
+    return {"model": "patient", "weights": WEIGHTS, "evidence": evidence, "voe": 3}
+
+
+@pytest.fixture(scope="module")
+def cache():
+    return ModelCache()
+
+
+@pytest.mark.parametrize("value", [5, 2, -1, True, "maybe", [1.0], [float("nan"), 1.0]])
+def test_bad_evidence_does_not_poison_batch(cache, value):
+    valid = request({"smoking": "1"})
+    expected = solve_batch(cache, [valid])[0]
+
+    responses = solve_batch(cache, [valid, request({"smoking": value}), valid])
+
+    assert "error" in responses[1]
+    assert responses[0] == expected
+    assert responses[2] == expected
+
+
+def test_state_index_matches_label(cache):
+    by_index, by_label = solve_batch(cache, [request({"smoking": 1}), request({"smoking": "1"})])
+
+    assert "error" not in by_index
+    assert by_index == by_label
+
+
+@pytest.mark.parametrize("weight", ["NaN", "Infinity", "-Infinity"])
+def test_non_finite_weights_are_rejected(cache, weight):
+    payload = json.loads('{"model": "patient", "weights": {"remission": %s, "cost": 1}}' % weight)
+    valid = request({"smoking": "1"})
+
+    responses = solve_batch(cache, [payload, valid])
+
+    assert "finite" in responses[0]["error"]
+    assert responses[1] == solve_batch(cache, [valid])[0]